@@ -15,27 +15,47 @@ if sys.version_info < (3, 10):
     sys.exit(1)
 
 import argparse
+import bisect
+import codecs
 import hashlib
+import http.client
 import json
 import os
 import platform
 import plistlib
 import re
 import shlex
+import shutil
+import signal
 import subprocess
+import threading
+import time
+import urllib.parse
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass, field, fields, is_dataclass
 from datetime import datetime
-from functools import partial
+from functools import cache, cached_property, partial
 from itertools import chain
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, Callable, Iterable, Optional, Sequence, TypeAlias, cast
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    TypeAlias,
+    cast,
+)
 
 
 # Basic recovery safety net for when Path is broken and jsonnet can't be found.
+@cache
 def find_jsonnet_command() -> str:
-    import shutil
-
     # Prefer an on-path jsonnet if available
     on_path = shutil.which('jsonnet')
     if on_path:
@@ -78,31 +98,154 @@ def mingify_path(path: str) -> str:
     return path
 
 
-def path_is_within(child: Path, parent: Path) -> bool:
-    """Return True if `child` is located within `parent` (inclusive of deeper descendants).
+class PathSet:
+    """Paths compared component by component, without touching the filesystem.
 
-    Resolves both paths to handle symlinks/relative segments. Returns False on mismatch.
+    Keys are sorted once, so each path's descendants immediately follow it and
+    pruning parents or children is a single pass. '/foo/bar2' is a sibling of
+    '/foo/bar', not a child. Spellings of the same path ('a/b', 'a/b/') collapse
+    to the one that sorts first.
     """
-    try:
-        child.resolve().relative_to(parent.resolve())
-        return True
-    except Exception:
-        return False
 
+    def __init__(self, paths: Iterable[Path | str] = ()) -> None:
+        spellings: dict[tuple[str, ...], Path | str] = {}
+        for path in sorted(paths, key=str):
+            spellings.setdefault(Path(path).parts, path)
+        self.keys = sorted(spellings)
+        self.spellings = spellings
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[Path | str]:
+        return (self.spellings[key] for key in self.keys)
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, (Path, str)) and Path(path).parts in self.spellings
 
-def git_tracked_files(root: Path) -> set[Path]:
-    """Return repository-relative paths tracked by Git."""
+    def roots(self) -> list[Path | str]:
+        """Return the paths with no ancestor in the set, in sorted order."""
+        roots: list[tuple[str, ...]] = []
+        for key in self.keys:
+            if not roots or key[: len(roots[-1])] != roots[-1]:
+                roots.append(key)
+        return [self.spellings[key] for key in roots]
+
+    def leaves(self) -> list[Path | str]:
+        """Return the paths with no descendant in the set, in sorted order."""
+        return [
+            self.spellings[key]
+            for key, following in zip(self.keys, [*self.keys[1:], None])
+            if following is None or following[: len(key)] != key
+        ]
+
+    def covers(self, path: Path | str) -> bool:
+        """Return True if `path` or one of its ancestors is in the set."""
+        parts = Path(path).parts
+        return any(parts[:depth] in self.spellings for depth in range(len(parts) + 1))
+
+    def overlaps(self, path: Path | str) -> bool:
+        """Return True if the set holds `path`, an ancestor or a descendant of it."""
+        if self.covers(path):
+            return True
+        parts = Path(path).parts
+        index = bisect.bisect_right(self.keys, parts)
+        return index < len(self.keys) and self.keys[index][: len(parts)] == parts
+
+
+def git_ls_files(root: Path) -> list[str]:
+    """Return repository-relative POSIX paths tracked by Git."""
     result = subprocess.run(
         ['git', 'ls-files', '-z'],
         cwd=root,
         check=True,
         capture_output=True,
     )
-    return {
-        Path(os.fsdecode(raw_path))
-        for raw_path in result.stdout.split(b'\0')
-        if raw_path
-    }
+    return [
+        os.fsdecode(raw_path) for raw_path in result.stdout.split(b'\0') if raw_path
+    ]
+
+
+class GitTrackedIndex:
+    """Git-tracked paths kept sorted so directory queries are two bisects.
+
+    Every path under `dir/` sorts between `dir/` and `dir0` ('0' follows '/').
+    """
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        self.paths = sorted(paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: object) -> bool:
+        key = path.as_posix() if isinstance(path, Path) else path
+        index = bisect.bisect_left(self.paths, key)
+        return index < len(self.paths) and self.paths[index] == key
+
+    def under(self, directory: Path | str) -> list[str]:
+        """Return the tracked paths below `directory`, in sorted order."""
+        prefix = Path(directory).as_posix()
+        if prefix == '.':
+            return list(self.paths)
+        lo = bisect.bisect_left(self.paths, prefix + '/')
+        hi = bisect.bisect_left(self.paths, prefix + '0', lo)
+        return self.paths[lo:hi]
+
+
+GIT_TRACKED_CACHE_NAME = 'git_tracked.json'
+
+_git_tracked_indexes: dict[tuple[Path, tuple[int, int]], GitTrackedIndex] = {}
+
+
+def git_tracked_index(root: Path) -> GitTrackedIndex:
+    """Return the tracked-file index for `root`, reused while .git/index is unchanged.
+
+    The index is kept per process (shared by every host in a run) and in
+    out/git_tracked.json between runs, keyed by the Git index's mtime and size.
+    """
+    git_index = root / '.git' / 'index'
+    try:
+        stat = git_index.stat()
+    except OSError:
+        # Worktrees, submodules or no repository: ask git every time.
+        return GitTrackedIndex(git_ls_files(root))
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _git_tracked_indexes.get((root, key))
+    if cached is not None:
+        return cached
+
+    cache_path = OUT_DIR_ROOT / GIT_TRACKED_CACHE_NAME
+    index: Optional[GitTrackedIndex] = None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if (
+            isinstance(data, dict)
+            and data.get('root') == root.as_posix()
+            and data.get('git_index') == list(key)
+            and isinstance(data.get('paths'), list)
+        ):
+            index = GitTrackedIndex(cast(list[str], data['paths']))
+    except (OSError, ValueError):
+        pass
+    if index is None:
+        index = GitTrackedIndex(git_ls_files(root))
+        # A racily-recent index could change again without its mtime moving.
+        if stat.st_mtime_ns < time.time_ns() - RACY_FINGERPRINT_WINDOW_NS:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            write_text_atomic(
+                cache_path,
+                json.dumps(
+                    {
+                        'root': root.as_posix(),
+                        'git_index': list(key),
+                        'paths': index.paths,
+                    }
+                ),
+            )
+    _git_tracked_indexes[(root, key)] = index
+    return index
 
 
 CWD: Path = Path.cwd()
@@ -132,6 +275,30 @@ BASH_COMMAND_PREFIX = 'BASH_COMMAND: '
 
 # Global flag toggled by CLI to influence Jsonnet ext vars
 TRACE_STARTUP_FLAG = False
+# Global flag toggled by CLI to ignore recorded stat fingerprints and rehash sources
+VERIFY_CACHE_FLAG = False
+# Worker count for parallelizable preprocessing, set by --jobs
+PARALLEL_JOBS = os.cpu_count() or 1
+# Global flag toggled by CLI to render all hosts' Jsonnet from one generated program
+JSONNET_BATCH_FLAG = False
+# Age after which cached curl downloads are revalidated, set by --curl-ttl
+CURL_CACHE_TTL_SECONDS = 24 * 60 * 60
+CURL_TIMEOUT_SECONDS = 60
+# Concurrent curl_maps downloads; I/O bound, so not tied to the CPU count
+CURL_DOWNLOAD_JOBS = 8
+# Upper bound on an idle ssh ControlMaster if the run dies before tearing it down
+SSH_CONTROL_PERSIST = '10m'
+
+# Set by --timings: records every op run_ops executes.
+OP_TIMINGS: Optional[OpTimings] = None
+
+
+def ssh_multiplexing_supported() -> bool:
+    return os.name != 'nt' and sys.platform != 'cygwin'
+
+
+def ssh_control_dir() -> Path:
+    return OUT_DIR_ROOT / 'ssh'
 
 
 def make_shell_command(run_args: list[str]) -> str:
@@ -215,6 +382,8 @@ class Host:
     jsonnet_maps: dict[str, str] = field(default_factory=dict[str, str])
     jsonnet_multi_maps: dict[str, str] = field(default_factory=dict[str, str])
     curl_maps: dict[str, str] = field(default_factory=dict[str, str])
+    # Optional pinned sha256 per curl_maps URL (4th element of a curl_maps entry)
+    curl_digests: dict[str, str] = field(default_factory=dict[str, str])
     macros: dict[str, list[str]] = field(default_factory=dict[str, list[str]])
 
     prestaged_files: set[str] = field(default_factory=set[str])
@@ -231,10 +400,8 @@ class Host:
     )  # cache for jsonnet outputs
     local_curl_dir: Path = field(init=False, default=Path())  # cache for curl downloads
     cache_json_path: Path = field(init=False, default=Path())
+    stage_state_path: Path = field(init=False, default=Path())
     remote_staging_dir: str = field(init=False, default='')
-    # Cache validity flags computed on init
-    jsonnet_cache_valid: bool = field(init=False, default=False)
-    curl_cache_valid: bool = field(init=False, default=False)
 
     def __post_init__(self) -> None:
 
@@ -275,11 +442,17 @@ class Host:
 
         # Promote curl maps without exposing cache dirs
         promoted_curl_entries: list[tuple[str, str, str]] = []
+        self.curl_digests = {
+            src: normalize_sha256_digest(digest)
+            for src, digest in dict(self.curl_digests).items()
+        }
         if isinstance(self.curl_maps, list):
-            for src, dest, target in self.curl_maps:
+            for src, dest, target, *pinned in self.curl_maps:
                 self.file_maps[dest] = target
                 self.prestaged_files.add(dest)
                 promoted_curl_entries.append((src, dest, target))
+                if pinned and pinned[0]:
+                    self.curl_digests[src] = normalize_sha256_digest(pinned[0])
             self.curl_maps = {src: dest for (src, dest, _) in promoted_curl_entries}
         else:
             self.curl_maps = dict(self.curl_maps)
@@ -307,25 +480,51 @@ class Host:
         self.local_jsonnet_dir = self.local_out_dir / 'gen'
         self.local_curl_dir = self.local_out_dir / 'curl'
         self.cache_json_path = self.local_out_dir / 'cache.json'
+        self.stage_state_path = self.local_out_dir / 'stage_state.json'
         self.remote_staging_dir = f'{self.home}/{self.config_dir}-staging'
 
-        # Establish cache validity on creation
-        previous_hashes = self.read_cache_hashes()
-        prev_jsonnet = previous_hashes.get('jsonnet_inputs_hash', '')
-        prev_curl = previous_hashes.get('curl_inputs_hash', '')
-        curr_jsonnet = self.compute_jsonnet_inputs_hash()
-        curr_curl = self.compute_curl_inputs_hash()
-        self.jsonnet_cache_valid = (
-            curr_jsonnet == prev_jsonnet
+    # Cache validity is computed on first access so that hosts which are never
+    # staged (and operations that don't stage at all) skip the source walk.
+    @cached_property
+    def previous_cache(self) -> dict[str, Any]:
+        """cache.json as written by the previous run."""
+        return self.read_cache_json()
+
+    @cached_property
+    def jsonnet_cache_valid(self) -> bool:
+        prev_jsonnet = self.read_cache_hashes().get('jsonnet_inputs_hash', '')
+        return (
+            self.compute_jsonnet_inputs_hash() == prev_jsonnet
             and self.local_jsonnet_dir.is_dir()
             and self._cached_jsonnet_outputs_exist()
         )
-        self.curl_cache_valid = (
-            curr_curl == prev_curl
+
+    @cached_property
+    def curl_cache_valid(self) -> bool:
+        prev_curl = self.read_cache_hashes().get('curl_inputs_hash', '')
+        return (
+            self.compute_curl_inputs_hash() == prev_curl
             and self.local_curl_dir.is_dir()
             and self._cached_curl_outputs_exist()
+            and not self.stale_curl_sources()
         )
 
+    def stale_curl_sources(self) -> set[str]:
+        """Return curl_maps URLs not linked from a fresh or pinned store blob."""
+        store = get_curl_store()
+        stale: set[str] = set()
+        for src, dest in self.curl_maps.items():
+            blob = store.resolve(src, self.curl_digests.get(src))
+            try:
+                linked = blob is not None and os.path.samefile(
+                    blob, self.local_curl_dir / dest
+                )
+            except OSError:
+                linked = False
+            if not linked:
+                stale.add(src)
+        return stale
+
     def _cached_jsonnet_outputs_exist(self) -> bool:
         file_targets = [
             self.local_jsonnet_dir / rel_path for rel_path in self.jsonnet_maps.values()
@@ -344,6 +543,32 @@ class Host:
             for rel_path in self.curl_maps.values()
         )
 
+    def describe_staged_path(self, rel_path: str) -> tuple[str, str]:
+        """Return (target path under home, origin) for a staged relative path.
+
+        Origin is one of 'file', 'directory', 'jsonnet' or 'curl'.
+        """
+        if rel_path in self.file_maps:
+            if rel_path in self.jsonnet_maps.values():
+                origin = 'jsonnet'
+            elif rel_path in self.curl_maps.values():
+                origin = 'curl'
+            else:
+                origin = 'file'
+            return self.file_maps[rel_path], origin
+        containing = [
+            d for d in self.directory_maps if rel_path.startswith(d.rstrip('/') + '/')
+        ]
+        if not containing:
+            raise ValueError(f'{rel_path} is not staged for {self.hostname}')
+        directory = max(containing, key=len)
+        target_dir = self.directory_maps[directory].rstrip('/')
+        remainder = rel_path[len(directory.rstrip('/')) + 1 :]
+        origin = (
+            'jsonnet' if directory in self.jsonnet_multi_maps.values() else 'directory'
+        )
+        return f'{target_dir}/{remainder}', origin
+
     def __repr__(self) -> str:
         return self.hostname
 
@@ -353,9 +578,7 @@ class Host:
         Includes ext vars, entry file names (maps + multimaps), and the content
         of all *.jsonnet/*.libsonnet files under source_dir excluding OUT_DIR_ROOT.
         """
-        root = Path(CWD)
-        out_root = OUT_DIR_ROOT.resolve()
-
+        merge_source_fingerprints(self.previous_cache.get('source_fingerprints'))
         hasher = hashlib.sha256()
 
         # Include ext vars
@@ -370,35 +593,95 @@ class Host:
             hasher.update(entry.encode('utf-8'))
 
         # Hash Jsonnet sources outside OUT_DIR_ROOT
-        candidates = [
-            p for p in root.rglob('*.jsonnet') if not path_is_within(p, out_root)
-        ]
-        candidates += [
-            p for p in root.rglob('*.libsonnet') if not path_is_within(p, out_root)
-        ]
-        candidates.sort()
-        for p in candidates:
-            with open(p, 'rb') as f:
-                hasher.update(f.read())
+        for p in jsonnet_source_files(CWD):
+            hasher.update(cache_relative_path(p).encode('utf-8'))
+            hasher.update(file_content_digest(p).encode('utf-8'))
 
         return hasher.hexdigest()
 
-    def read_cache_hashes(self) -> dict[str, str]:
+    def read_cache_json(self) -> dict[str, Any]:
         try:
             with open(self.cache_json_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 if not isinstance(data, dict):
                     return {}
-                return {
-                    key: value
-                    for key, value in data.items()
-                    if isinstance(key, str) and isinstance(value, str)
-                }
+                return cast(dict[str, Any], data)
         except FileNotFoundError:
             return {}
         except json.JSONDecodeError:
             return {}
 
+    def read_cache_hashes(self) -> dict[str, str]:
+        return {
+            key: value
+            for key, value in self.previous_cache.items()
+            if isinstance(key, str) and isinstance(value, str)
+        }
+
+    def jsonnet_entries(self) -> list[tuple[str, str, bool]]:
+        """Return (source, cache-relative output, is_multicast) for every Jsonnet entry."""
+        return [(src, dest, False) for src, dest in self.jsonnet_maps.items()] + [
+            (src, dest, True) for src, dest in self.jsonnet_multi_maps.items()
+        ]
+
+    def compute_jsonnet_entry_records(self) -> dict[str, dict[str, Any]]:
+        """Build the per-entry import graph persisted in cache.json.
+
+        Each record holds the entry's transitive imports (including itself), the
+        ext var keys read anywhere in that closure, and a digest over both.
+        Records that are still current are carried over without rescanning.
+        """
+        previous = self.previous_cache.get('jsonnet_entries')
+        if not isinstance(previous, dict):
+            previous = {}
+        stale = self.stale_jsonnet_entries()
+        ext_vars = get_ext_vars(self)
+        records: dict[str, dict[str, Any]] = {}
+        for src, dest, is_multicast in self.jsonnet_entries():
+            if src not in stale and not VERIFY_CACHE_FLAG:
+                records[src] = previous[src]
+                continue
+            inputs, ext_var_keys = jsonnet_import_closure(CWD / src)
+            records[src] = {
+                'digest': compute_jsonnet_entry_digest(
+                    src, dest, is_multicast, inputs, ext_var_keys, ext_vars
+                ),
+                'imports': [cache_relative_path(p) for p in inputs],
+                'ext_vars': ext_var_keys,
+            }
+        return records
+
+    def stale_jsonnet_entries(self) -> set[str]:
+        """Return the Jsonnet entry sources whose dependency closure changed.
+
+        The persisted import graph is reused as-is: if none of the files it
+        names changed, the entry's imports cannot have changed either.
+        """
+        merge_source_fingerprints(self.previous_cache.get('source_fingerprints'))
+        previous = self.previous_cache.get('jsonnet_entries')
+        if not isinstance(previous, dict):
+            previous = {}
+        ext_vars = get_ext_vars(self)
+
+        stale: set[str] = set()
+        for src, dest, is_multicast in self.jsonnet_entries():
+            record = previous.get(src)
+            output = self.local_jsonnet_dir / dest
+            output_exists = output.is_dir() if is_multicast else output.is_file()
+            if not isinstance(record, dict) or not output_exists:
+                stale.add(src)
+                continue
+            inputs = [CWD / p for p in record.get('imports', [])]
+            if not inputs or not all(p.is_file() for p in inputs):
+                stale.add(src)
+                continue
+            digest = compute_jsonnet_entry_digest(
+                src, dest, is_multicast, inputs, record.get('ext_vars', []), ext_vars
+            )
+            if digest != record.get('digest'):
+                stale.add(src)
+        return stale
+
     def compute_curl_inputs_hash(self) -> str:
         """Compute a hash over curl-related inputs for this host.
 
@@ -411,17 +694,24 @@ class Host:
         for src, staged in items:
             hasher.update(src.encode('utf-8'))
             hasher.update(staged.encode('utf-8'))
+            hasher.update(self.curl_digests.get(src, '').encode('utf-8'))
         return hasher.hexdigest()
 
     def update_cache_hashes(self) -> None:
-        current = {
+        current: dict[str, Any] = {
             'jsonnet_inputs_hash': self.compute_jsonnet_inputs_hash(),
+            'jsonnet_entries': self.compute_jsonnet_entry_records(),
             'curl_inputs_hash': self.compute_curl_inputs_hash(),
+            'source_fingerprints': snapshot_source_fingerprints(),
         }
         self.cache_json_path.parent.mkdir(parents=True, exist_ok=True)
         with open(self.cache_json_path, 'w', encoding='utf-8') as f:
             json.dump(current, f, indent=4, sort_keys=True)
 
+    @cached_property
+    def macro_engine(self) -> MacroEngine:
+        return MacroEngine(self.macros)
+
     def get_inflated_macro(
         self, key: str, file_path: Path, pragma_arg: Optional[str] = None
     ) -> list[str]:
@@ -429,37 +719,82 @@ class Host:
 
         Supported tokens in templates:
         - @@FILE_NAME   -> uppercased stem of the file name being processed
-        - @@NOW         -> current timestamp (YYYY-MM-DD HH:MM)
+        - @@NOW         -> timestamp of this run (YYYY-MM-DD HH:MM)
         - @@PRAGMA_ARG  -> argument following the pragma on the source line
         """
-        arg_value = pragma_arg or ''
-        now_value = datetime.now().strftime('%Y-%m-%d %H:%M')
-        file_stem_upper = file_path.stem.upper()
+        return self.macro_engine.inflate(key, file_path.stem.upper(), pragma_arg or '')
+
+    def ssh_control_options(self) -> list[str]:
+        """ssh options that share one ControlMaster connection per host.
+
+        The socket lives under out/ssh (%C hashes host, port and user so the
+        path stays short). Multiplexing is not available on Windows.
+        """
+        if not ssh_multiplexing_supported():
+            return []
+        control_path = (ssh_control_dir() / '%C').as_posix()
         return [
-            v.replace('@@FILE_NAME', file_stem_upper)
-            .replace('@@NOW', now_value)
-            .replace('@@PRAGMA_ARG', arg_value)
-            for v in self.macros.get(key, [])
+            '-o',
+            'ControlMaster=auto',
+            '-o',
+            f'ControlPath={control_path}',
+            '-o',
+            f'ControlPersist={SSH_CONTROL_PERSIST}',
         ]
 
+    def ssh_command(self, *args: str) -> RunCmd:
+        return ['ssh', *self.ssh_control_options(), *args]
+
+    def scp_command(self, *args: str) -> RunCmd:
+        return ['scp', *self.ssh_control_options(), *args]
+
+    def rsync_command(self, *args: str) -> RunCmd:
+        options = self.ssh_control_options()
+        remote_shell = ['-e', make_shell_command(['ssh', *options])] if options else []
+        return ['rsync', *remote_shell, *args]
+
+    def close_ssh_control_master(self) -> None:
+        """Ask a running ControlMaster for this host to exit; a no-op if none."""
+        if self.is_localhost or not ssh_multiplexing_supported():
+            return
+        control_dir = ssh_control_dir()
+        if not control_dir.is_dir() or not any(control_dir.iterdir()):
+            return
+        subprocess.run(
+            self.ssh_command('-O', 'exit', self.connection_host or self.hostname),
+            check=False,
+            capture_output=True,
+        )
+
     def make_ops(self, ops: list[RunOp]) -> list[RunOp]:
         if self.is_localhost:
             return list(ops)
 
+        # Consecutive commands share one ssh round trip; messages stay in order.
         converted: list[RunOp] = []
-        for op in ops:
-            if isinstance(op, list):
+        batch: list[RunCmd] = []
+
+        def flush_batch() -> None:
+            if len(batch) == 1:
                 converted.append(
-                    [
-                        'ssh',
+                    self.ssh_command(
                         self.connection_host or self.hostname,
-                        make_shell_command(op),
-                    ]
+                        make_shell_command(batch[0]),
+                    )
                 )
+            elif batch:
+                converted.append(RemoteBatch(self, list(batch)))
+            batch.clear()
+
+        for op in ops:
+            if isinstance(op, list):
+                batch.append(op)
             elif isinstance(op, str):
+                flush_batch()
                 converted.append(op)
             else:
                 raise TypeError('Callable operations cannot be proxied through SSH')
+        flush_batch()
         return converted
 
     def add_alias(self, alias: Optional[str]) -> None:
@@ -484,6 +819,90 @@ class Host:
         return tokens
 
 
+REMOTE_STATUS_MARKER = '__DOTFILES_OP_STATUS__'
+
+
+@dataclass
+class RemoteBatch:
+    """Run consecutive remote commands as one script over a single ssh session.
+
+    After each command the script prints a status marker line, which is
+    stripped from the relayed output and mapped back onto the original
+    command. The script stops at the first failure. That command is then
+    reported and raised exactly as the equivalent standalone `ssh host cmd`
+    op would have been.
+    """
+
+    host: Host
+    commands: list[RunCmd]
+
+    def standalone_op(self, command: RunCmd) -> RunCmd:
+        return self.host.ssh_command(
+            self.host.connection_host or self.host.hostname,
+            make_shell_command(command),
+        )
+
+    def script(self) -> str:
+        lines: list[str] = []
+        for index, command in enumerate(self.commands):
+            lines.append(make_shell_command(command))
+            lines.append(
+                f'__status=$?; printf "\\n{REMOTE_STATUS_MARKER} {index} %d\\n" '
+                '"$__status"; [ "$__status" -eq 0 ] || exit "$__status"'
+            )
+        return '\n'.join(lines) + '\n'
+
+    def describe(self) -> list[RunOp]:
+        ops: list[RunOp] = [
+            f'>> {len(self.commands)} commands batched over one ssh session to '
+            f'{self.host.hostname}'
+        ]
+        ops.extend(self.standalone_op(command) for command in self.commands)
+        return ops
+
+    def __call__(self) -> None:
+        remote_command = f'sh -c {shlex.quote(self.script())}'
+        statuses: dict[int, int] = {}
+        with subprocess.Popen(
+            self.host.ssh_command(
+                self.host.connection_host or self.host.hostname, remote_command
+            ),
+            stdout=subprocess.PIPE,
+            # Remote tools may print non-UTF-8 bytes; relay them, don't crash.
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+        ) as process:
+            assert process.stdout is not None
+            # The marker is printed after a newline; swallow that blank line.
+            pending_blank = False
+            for line in process.stdout:
+                if line.startswith(REMOTE_STATUS_MARKER):
+                    _, index, status = line.split()
+                    statuses[int(index)] = int(status)
+                    pending_blank = False
+                    continue
+                if pending_blank:
+                    sys.stdout.write('\n')
+                pending_blank = line == '\n'
+                if not pending_blank:
+                    sys.stdout.write(line)
+                sys.stdout.flush()
+            if pending_blank:
+                sys.stdout.write('\n')
+            returncode = process.wait()
+
+        for index, command in enumerate(self.commands):
+            status = statuses.get(index)
+            if status is None:
+                # ssh itself failed before this command reported back.
+                status = returncode or 255
+            if status != 0:
+                failed = self.standalone_op(command)
+                print(f'Failed running: {" ".join(failed)}')
+                raise subprocess.CalledProcessError(status, failed)
+
+
 @dataclass
 class Ec2WorkstationMetadata:
     instance_id: str
@@ -546,18 +965,31 @@ class Config:
     vim_pack_plugin_opt_repos: list[str]
     zsh_plugin_repos: list[str]
 
+    CACHE_PATH_NAME = 'config_cache.json'
+
     @staticmethod
-    def load() -> 'Config':
-        """Parse and instantiate the apply configuration from Jsonnet."""
+    def load(skip_cache: bool = False) -> 'Config':
+        """Parse and instantiate the apply configuration from Jsonnet.
+
+        The evaluated JSON is memoized in OUT_DIR_ROOT, keyed by the config's
+        import closure and the ext vars it reads, unless `skip_cache` is set.
+        """
         config_path = Path.cwd() / 'apply_configs.jsonnet'
         if not config_path.is_file():
             raise ValueError(f'Missing config file: {config_path}')
 
         ext_vars = get_ext_vars()
+        cache_path = OUT_DIR_ROOT / Config.CACHE_PATH_NAME
 
-        config_dict: dict[str, Any] = cast(
-            dict[str, Any], parse_jsonnet_now(config_path, ext_vars)
+        cached = (
+            None
+            if skip_cache
+            else read_memoized_jsonnet(cache_path, config_path, ext_vars)
         )
+        if cached is None:
+            cached = parse_jsonnet_now(config_path, ext_vars)
+            write_memoized_jsonnet(cache_path, config_path, ext_vars, cached)
+        config_dict: dict[str, Any] = cast(dict[str, Any], cached)
 
         hosts_raw: list[dict[str, Any]] = config_dict.get('hosts', [])
 
@@ -602,6 +1034,8 @@ def print_ops(ops: list[RunOp], quiet: bool = False) -> None:
                 print(entry)
         elif isinstance(entry, list):
             print(f'DEBUG: {" ".join(entry)}')
+        elif describe := getattr(entry, 'describe', None):
+            print_ops(describe(), quiet=quiet)
         elif callable(entry):
             func = getattr(entry, 'func', None)
             keywords = getattr(entry, 'keywords', None)
@@ -617,33 +1051,579 @@ def print_ops(ops: list[RunOp], quiet: bool = False) -> None:
 
 def run_ops(ops: list[RunOp], quiet: bool = False) -> None:
     for entry in ops:
-        if isinstance(entry, str):
-            if entry.startswith(BASH_COMMAND_PREFIX):
-                raise ValueError('Bash commands should be executed through a script')
-            if not quiet:
-                print(entry)
-        elif isinstance(entry, list):
-            if not all(isinstance(arg, str) for arg in entry):
-                raise TypeError(
-                    f'All elements of a command list must be strings: {entry}'
+        if OP_TIMINGS is None or isinstance(entry, (str, OpGraph)):
+            run_op(entry, quiet=quiet)
+        else:
+            OP_TIMINGS.measure(entry, partial(run_op, entry, quiet=quiet))
+
+
+def run_op(entry: RunOp, quiet: bool = False) -> None:
+    if isinstance(entry, str):
+        if entry.startswith(BASH_COMMAND_PREFIX):
+            raise ValueError('Bash commands should be executed through a script')
+        if not quiet:
+            print(entry)
+    elif isinstance(entry, list):
+        if not all(isinstance(arg, str) for arg in entry):
+            raise TypeError(f'All elements of a command list must be strings: {entry}')
+        try:
+            subprocess.run(entry, check=True)
+        except subprocess.CalledProcessError:
+            print(f'Failed running: {" ".join(entry)}')
+            raise
+        except FileNotFoundError:
+            # Hacky workaround for running in Cygwin.
+            if entry[0] == '/bin/bash':
+                print(
+                    f'! Failed running: "{" ".join(entry)}". Try again from the command line.'
                 )
-            try:
-                subprocess.run(entry, check=True)
-            except subprocess.CalledProcessError:
-                print(f'Failed running: {" ".join(entry)}')
+            else:
                 raise
-            except FileNotFoundError:
-                # Hacky workaround for running in Cygwin.
-                if entry[0] == '/bin/bash':
-                    print(
-                        f'! Failed running: "{" ".join(entry)}". Try again from the command line.'
-                    )
+    elif callable(entry):
+        entry()
+    else:
+        raise TypeError('Unsupported operation type')
+
+
+@dataclass
+class OpTiming:
+    name: str
+    host: str
+    phase: str
+    start: float
+    seconds: float = 0.0
+    status: str = 'running'
+    bytes_moved: Optional[int] = None
+    thread: int = 0
+    # Time spent in spans recorded while this op was running (e.g. macros).
+    nested_seconds: float = 0.0
+
+    @property
+    def exclusive_seconds(self) -> float:
+        return max(0.0, self.seconds - self.nested_seconds)
+
+
+def ssh_command_host(command: RunCmd) -> Optional[str]:
+    """Return the destination of an `ssh [-o opt]... host cmd` command."""
+    args = iter(command[1:])
+    for arg in args:
+        if arg == '-o':
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def op_timing_labels(entry: RunOp) -> tuple[str, str, str]:
+    """Return (host, phase, name) for an op recorded by --timings."""
+    if isinstance(entry, list):
+        name = make_shell_command(entry)
+        if entry[0] == 'rsync':
+            return (entry[-1].split(':', 1)[0], 'rsync', name)
+        if entry[0] == 'ssh':
+            host = ssh_command_host(entry) or ''
+            phase = 'remote finish' if 'finish.sh' in entry[-1] else 'remote'
+            return (host, phase, name)
+        phase = 'finish-script' if entry[-1].endswith('finish.sh') else 'command'
+        return ('', phase, name)
+    if isinstance(entry, CurlBatchOp):
+        return ('', 'curl', f'{len(entry.fetches)} curl downloads')
+    if isinstance(entry, JsonnetBatchOp):
+        return ('', 'jsonnet', f'{len(entry.tasks)} jsonnet evaluations')
+    if isinstance(entry, IncrementalStage):
+        return (entry.host.hostname, 'copy', 'incremental stage')
+    if isinstance(entry, BulkCopy):
+        return ('', 'copy', 'bulk copy')
+    if isinstance(entry, RemoteBatch):
+        return (
+            entry.host.hostname,
+            'remote',
+            f'{len(entry.commands)} batched commands',
+        )
+    if isinstance(entry, RemoteFinish):
+        return (entry.host.hostname, 'remote finish', 'finish script')
+    if isinstance(entry, HostPipelines):
+        return ('', 'pipelines', f'{len(entry.commands)} host pipelines')
+    func = getattr(entry, 'func', entry)
+    name = getattr(func, '__qualname__', None) or repr(entry)
+    if name.endswith('write_script'):
+        return ('', 'finish-script', 'write finish.sh')
+    if name.endswith('update_cache_hashes'):
+        return (
+            getattr(getattr(entry, '__self__', None), 'hostname', ''),
+            'cache',
+            name,
+        )
+    return ('', 'callable', name)
+
+
+RSYNC_BYTES_SENT_PATTERN = re.compile(rb'Total bytes sent: ([\d,.]+)')
+# The --stats block is printed last; only this much output is kept to parse it.
+RSYNC_STATS_TAIL_BYTES = 8192
+
+
+def run_rsync_with_stats(command: RunCmd) -> Optional[int]:
+    """Run an rsync op with --stats, relaying its output, and return the bytes sent."""
+    sys.stdout.flush()
+    process = subprocess.Popen(
+        [command[0], '--stats', *command[1:]], stdout=subprocess.PIPE
+    )
+    assert process.stdout is not None
+    tail = b''
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with process.stdout:
+        # Relay chunks as they arrive so --progress updates still show.
+        while chunk := process.stdout.read1(65536):
+            sys.stdout.write(decoder.decode(chunk))
+            sys.stdout.flush()
+            tail = (tail + chunk)[-RSYNC_STATS_TAIL_BYTES:]
+    returncode = process.wait()
+    if returncode:
+        print(f'Failed running: {" ".join(command)}')
+        raise subprocess.CalledProcessError(returncode, command)
+    match = RSYNC_BYTES_SENT_PATTERN.search(tail)
+    return int(re.sub(rb'[,.]', b'', match.group(1))) if match else None
+
+
+class OpTimings:
+    """Wall time, status and bytes moved for every op run under --timings.
+
+    Ops run inside an OpGraph node are attributed to the node's host (node
+    names are `<host>: <phase>`) unless the op names its own host.
+    """
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        # Wall-clock time of `origin`, so traces from several processes line up.
+        self.epoch = time.time()
+        self.records: list[OpTiming] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads: dict[int, int] = {}
+
+    def _stack(self) -> list[OpTiming]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return cast(list[OpTiming], stack)
+
+    @contextmanager
+    def node(self, name: str) -> Iterator[None]:
+        previous = getattr(self._local, 'node_host', '')
+        self._local.node_host = name.split(': ', 1)[0] if ': ' in name else ''
+        try:
+            yield
+        finally:
+            self._local.node_host = previous
+
+    @contextmanager
+    def span(
+        self, host: str, phase: str, name: str, entry: Any = None
+    ) -> Iterator[OpTiming]:
+        with self._lock:
+            thread = self._threads.setdefault(
+                threading.get_ident(), len(self._threads) + 1
+            )
+        record = OpTiming(
+            name,
+            host or getattr(self._local, 'node_host', ''),
+            phase,
+            time.perf_counter() - self.origin,
+            thread=thread,
+        )
+        stack = self._stack()
+        stack.append(record)
+        try:
+            yield record
+            record.status = 'ok'
+        except subprocess.CalledProcessError as e:
+            record.status = f'exit {e.returncode}'
+            raise
+        except BaseException as e:
+            record.status = type(e).__name__
+            raise
+        finally:
+            record.seconds = time.perf_counter() - self.origin - record.start
+            stack.pop()
+            if stack:
+                stack[-1].nested_seconds += record.seconds
+            moved = getattr(entry, 'bytes_moved', None)
+            if isinstance(moved, int):
+                record.bytes_moved = moved
+            with self._lock:
+                self.records.append(record)
+
+    def measure(self, entry: RunOp, run: Callable[[], None]) -> None:
+        host, phase, name = op_timing_labels(entry)
+        with self.span(host, phase, name, entry) as record:
+            if phase == 'rsync' and isinstance(entry, list):
+                record.bytes_moved = run_rsync_with_stats(entry)
+            else:
+                run()
+
+    def summary(self, top: int = 10) -> list[str]:
+        lines = [f'>> Slowest {min(top, len(self.records))} of {len(self.records)} ops']
+        slowest = sorted(self.records, key=lambda r: r.seconds, reverse=True)[:top]
+        for record in slowest:
+            moved = '' if record.bytes_moved is None else f' {record.bytes_moved}B'
+            where = f'{record.host} ' if record.host else ''
+            lines.append(
+                f'{record.seconds:8.3f}s  {where}[{record.phase}] {record.status}{moved}  {record.name}'
+            )
+
+        totals: dict[tuple[str, str], list[float]] = {}
+        for record in self.records:
+            total = totals.setdefault((record.host or '-', record.phase), [0.0, 0.0])
+            total[0] += record.exclusive_seconds
+            total[1] += record.bytes_moved or 0
+        lines.append('>> Time by host and phase (excluding nested spans)')
+        width = max(len(host) for host, _ in totals) if totals else 1
+        for (host, phase), (seconds, moved) in sorted(totals.items()):
+            lines.append(
+                f'{host.ljust(width)}  {phase:<14} {seconds:8.3f}s  {int(moved)}B'
+            )
+        return lines
+
+    def chrome_trace(self, process_name: str = 'apply.py') -> dict[str, Any]:
+        """Return the records as Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        events: list[dict[str, Any]] = [
+            {
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': pid,
+                'args': {'name': process_name},
+            }
+        ]
+        events.extend(
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': thread,
+                'args': {'name': f'worker {thread}'},
+            }
+            for thread in sorted(set(self._threads.values()))
+        )
+        events.extend(
+            {
+                'name': record.name,
+                'cat': record.phase,
+                'ph': 'X',
+                'ts': round((self.epoch + record.start) * 1_000_000),
+                'dur': round(record.seconds * 1_000_000),
+                'pid': pid,
+                'tid': record.thread,
+                'args': {
+                    'host': record.host,
+                    'status': record.status,
+                    'bytes': record.bytes_moved,
+                },
+            }
+            for record in sorted(self.records, key=lambda r: r.start)
+        )
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def host_trace_path(trace_path: Path, hostname: str) -> Path:
+    """Where a --parallel host pipeline writes its own --timings trace."""
+    return trace_path.with_name(f'{trace_path.name}.{hostname}.json')
+
+
+def merge_chrome_traces(trace: dict[str, Any], paths: Iterable[Path]) -> None:
+    """Append the events of the traces at `paths` to `trace`, deleting those files.
+
+    Each apply.py process traces under its own pid, so the merged trace shows
+    one process track per host pipeline. Missing files (a pipeline that was
+    killed or never started) are skipped.
+    """
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                trace['traceEvents'].extend(json.load(f).get('traceEvents', []))
+        except (OSError, ValueError):
+            continue
+        path.unlink()
+
+
+@contextmanager
+def timed_span(host: str, phase: str, name: str) -> Iterator[None]:
+    """Record a sub-step of an op under --timings; a no-op otherwise."""
+    if OP_TIMINGS is None:
+        yield
+        return
+    with OP_TIMINGS.span(host, phase, name):
+        yield
+
+
+@dataclass
+class OpNode:
+    """A named run of ops within an OpGraph, executed in order on one worker.
+
+    Nodes are ordered after every earlier node whose outputs overlap their
+    inputs or outputs (or whose inputs overlap their outputs), and after the
+    nodes named in `deps`.
+    """
+
+    name: str
+    ops: list[RunOp]
+    inputs: list[Path] = field(default_factory=list[Path])
+    outputs: list[Path] = field(default_factory=list[Path])
+    deps: list[str] = field(default_factory=list[str])
+
+
+@dataclass
+class OpGraph:
+    """Run OpNodes as soon as their dependencies finish, up to `jobs` at a time.
+
+    A failed node stops new nodes from starting; nodes already running are
+    allowed to finish and the first failure is then re-raised.
+    """
+
+    nodes: list[OpNode]
+    jobs: int = 1
+    quiet: bool = False
+
+    def dependencies(self) -> dict[str, list[str]]:
+        names = [node.name for node in self.nodes]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Duplicate op graph node names: {names}')
+        path_sets = [
+            (PathSet(node.outputs), PathSet(node.inputs)) for node in self.nodes
+        ]
+        dependencies: dict[str, list[str]] = {}
+        for index, node in enumerate(self.nodes):
+            for dep in node.deps:
+                if dep not in names:
+                    raise ValueError(f'Unknown dependency {dep!r} of {node.name!r}')
+            implied = [
+                earlier.name
+                for earlier, (written, read) in zip(self.nodes[:index], path_sets)
+                if any(
+                    written.overlaps(path) for path in chain(node.inputs, node.outputs)
+                )
+                or any(read.overlaps(path) for path in node.outputs)
+            ]
+            dependencies[node.name] = list(dict.fromkeys([*node.deps, *implied]))
+        return dependencies
+
+    def topological_order(self) -> list[OpNode]:
+        dependencies = self.dependencies()
+        by_name = {node.name: node for node in self.nodes}
+        ordered: list[OpNode] = []
+        done: set[str] = set()
+        while len(ordered) < len(self.nodes):
+            ready = [
+                node
+                for node in self.nodes
+                if node.name not in done
+                and all(dep in done for dep in dependencies[node.name])
+            ]
+            if not ready:
+                pending = sorted(set(by_name) - done)
+                raise ValueError(f'Op graph has a dependency cycle among {pending}')
+            ordered.extend(ready)
+            done.update(node.name for node in ready)
+        return ordered
+
+    def describe(self) -> list[RunOp]:
+        dependencies = self.dependencies()
+        ops: list[RunOp] = [
+            f'>> Op graph: {len(self.nodes)} nodes, up to {self.jobs} at a time'
+        ]
+        for node in self.topological_order():
+            after = dependencies[node.name]
+            ops.append(
+                f'== {node.name}' + (f' (after {", ".join(after)})' if after else '')
+            )
+            ops.extend(node.ops)
+        return ops
+
+    def _run_node(self, node: OpNode) -> None:
+        if OP_TIMINGS is None:
+            run_ops(node.ops, quiet=self.quiet)
+            return
+        with OP_TIMINGS.node(node.name):
+            run_ops(node.ops, quiet=self.quiet)
+
+    def __call__(self) -> None:
+        dependencies = self.dependencies()
+        self.topological_order()
+        done: set[str] = set()
+        started: set[str] = set()
+        running: dict[Future[None], OpNode] = {}
+        failure: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            while True:
+                if failure is None:
+                    for node in self.nodes:
+                        if node.name in started or not all(
+                            dep in done for dep in dependencies[node.name]
+                        ):
+                            continue
+                        started.add(node.name)
+                        future = executor.submit(self._run_node, node)
+                        running[future] = node
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        done.add(node.name)
+                    elif failure is None:
+                        failure = error
+
+        if failure is not None:
+            skipped = [node.name for node in self.nodes if node.name not in started]
+            if skipped:
+                print(f'Skipped after failure: {", ".join(skipped)}')
+            raise failure
+
+
+@dataclass
+class HostPipelineResult:
+    hostname: str
+    status: str
+    seconds: float
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == 'ok'
+
+
+@dataclass
+class HostPipelines:
+    """Run one apply.py process per host, up to `jobs` at a time.
+
+    Each child's output is streamed line by line with a `[host]` prefix. A
+    host that fails or exceeds `timeout` is killed and reported without
+    stopping the others; a summary table is printed once all have finished.
+    """
+
+    commands: dict[str, list[str]]
+    jobs: int = 1
+    timeout: Optional[float] = None
+
+    def describe(self) -> list[RunOp]:
+        ops: list[RunOp] = [
+            f'>> Running {len(self.commands)} host pipelines with up to {self.jobs} at a time'
+        ]
+        ops.extend(self.commands.values())
+        return ops
+
+    def _run_host(
+        self, hostname: str, command: list[str], prefix: str, print_lock: threading.Lock
+    ) -> HostPipelineResult:
+        start = time.monotonic()
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        try:
+            proc = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=env,
+                # A process group lets a timeout also kill ssh/rsync children.
+                start_new_session=os.name != 'nt',
+            )
+        except OSError as e:
+            with print_lock:
+                print(f'{prefix}{e}', flush=True)
+            return HostPipelineResult(hostname, 'failed to start', 0.0)
+
+        timed_out = threading.Event()
+
+        def kill() -> None:
+            timed_out.set()
+            try:
+                if os.name == 'nt':
+                    proc.kill()
                 else:
-                    raise
-        elif callable(entry):
-            entry()
+                    os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        timer = threading.Timer(self.timeout, kill) if self.timeout else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            assert proc.stdout is not None
+            for raw_line in proc.stdout:
+                line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+                with print_lock:
+                    print(f'{prefix}{line}', flush=True)
+            returncode = proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if timed_out.is_set():
+            status = f'timed out after {self.timeout:g}s'
+        elif returncode != 0:
+            status = f'failed (exit {returncode})'
         else:
-            raise TypeError('Unsupported operation type')
+            status = 'ok'
+        return HostPipelineResult(hostname, status, time.monotonic() - start)
+
+    def __call__(self) -> None:
+        if not self.commands:
+            return
+        width = max(len(name) for name in self.commands)
+        print_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            futures = [
+                executor.submit(
+                    self._run_host,
+                    hostname,
+                    command,
+                    f'[{hostname.ljust(width)}] ',
+                    print_lock,
+                )
+                for hostname, command in self.commands.items()
+            ]
+            results = [future.result() for future in futures]
+
+        print_host_pipeline_summary(results)
+        failures = [result for result in results if not result.succeeded]
+        if failures:
+            raise RuntimeError(
+                f'{len(failures)} of {len(results)} host pipelines failed: '
+                + ', '.join(result.hostname for result in failures)
+            )
+
+
+def print_host_pipeline_summary(results: list[HostPipelineResult]) -> None:
+    width = max([len('Host'), *(len(result.hostname) for result in results)])
+    status_width = max([len('Status'), *(len(result.status) for result in results)])
+    print(f'{"Host".ljust(width)}  {"Status".ljust(status_width)}  Duration')
+    for result in results:
+        print(
+            f'{result.hostname.ljust(width)}  {result.status.ljust(status_width)}  {result.seconds:7.1f}s'
+        )
+
+
+def host_pipeline_commands(
+    operation: str, hosts: Sequence[Host], forwarded_args: list[str]
+) -> dict[str, list[str]]:
+    """apply.py invocations that run `operation` for each host on its own."""
+    script = Path(__file__).resolve()
+    return {
+        host.hostname: [
+            sys.executable,
+            script.as_posix(),
+            operation,
+            '--hosts',
+            host.hostname,
+            '--working-dir',
+            CWD.as_posix(),
+            *forwarded_args,
+        ]
+        for host in hosts
+    }
 
 
 def update_workspace_extensions() -> None:
@@ -861,12 +1841,8 @@ def make_generate_shell_completion_bash_commands(config_root: Path) -> list[RunO
     return ops
 
 
-def remove_parents_from_set(paths: set[Path]) -> set[Path]:
-    return {
-        d
-        for d in paths
-        if not any(subdir != d and path_is_within(subdir, d) for subdir in paths)
-    }
+def remove_parents_from_set(paths: Iterable[Path]) -> set[Path]:
+    return {Path(path) for path in PathSet(paths).leaves()}
 
 
 def ensure_directories_exist_ops(
@@ -883,63 +1859,664 @@ def ensure_directories_exist_ops(
     return ops
 
 
-def remove_children_from_set(paths: set[str]) -> list[str]:
-    return sorted(
-        {
-            d
-            for d in paths
-            if not any(subdir != d and d.startswith(subdir) for subdir in paths)
-        }
-    )
+def remove_children_from_set(paths: Iterable[str]) -> list[str]:
+    return [str(path) for path in PathSet(paths).roots()]
 
 
-def copy_directories_local(
-    source_root: Path | str,
-    source_dirs: Iterable[str],
-    dest_root: Path | str,
-    dest_dirs: Iterable[str],
-) -> list[RunOp]:
-    src_root_path = source_root if isinstance(source_root, Path) else Path(source_root)
-    dest_root_path = dest_root if isinstance(dest_root, Path) else Path(dest_root)
-    source_dir_list = list(source_dirs)
-    dest_dir_list = list(dest_dirs)
+# Linux FICLONE ioctl: share extents with the source on btrfs/XFS/bcachefs.
+FICLONE_IOCTL = 0x40049409
 
-    ops: list[RunOp] = []
-    ops.extend(
-        ensure_directories_exist_ops({(dest_root_path / d) for d in dest_dir_list})
-    )
-    ops.extend(
-        [
-            [
-                'cp',
-                '-a',
-                (src_root_path / src).as_posix() + '/.',
-                (dest_root_path / dest).as_posix(),
-            ]
-            for src, dest in zip(source_dir_list, dest_dir_list)
-        ]
-    )
 
-    return ops
+def _reflink_file(src_fd: int, dest_fd: int) -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import fcntl
+
+        fcntl.ioctl(dest_fd, FICLONE_IOCTL, src_fd)
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def copy_file_contents(src: Path, dest: Path) -> None:
+    """Copy bytes in-kernel: reflink, then copy_file_range, then sendfile."""
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        src_fd, dest_fd = fsrc.fileno(), fdst.fileno()
+        if _reflink_file(src_fd, dest_fd):
+            return
+        size = os.fstat(src_fd).st_size
+        for copy_chunk in (
+            getattr(os, 'copy_file_range', None),
+            getattr(os, 'sendfile', None),
+        ):
+            if copy_chunk is None:
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if copy_chunk is os.sendfile:
+                        copied = os.sendfile(dest_fd, src_fd, offset, size - offset)
+                    else:
+                        copied = os.copy_file_range(
+                            src_fd, dest_fd, size - offset, offset, offset
+                        )
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                # Unsupported for this pair of files; restart with the next method.
+                os.ftruncate(dest_fd, 0)
+                continue
+            if offset >= size:
+                return
+            os.ftruncate(dest_fd, 0)
+        fsrc.seek(0)
+        fdst.seek(0)
+        while chunk := fsrc.read(1024 * 1024):
+            fdst.write(chunk)
+
+
+def copy_file_preserving(src: Path, dest: Path) -> None:
+    """Replace `dest` with a copy of `src`, keeping its mode and mtime."""
+    if dest.is_symlink() or dest.exists():
+        # Never write through an existing link into someone else's inode.
+        dest.unlink()
+    if src.is_symlink():
+        os.symlink(os.readlink(src), dest)
+        return
+    copy_file_contents(src, dest)
+    stat = src.stat()
+    os.chmod(dest, stat.st_mode & 0o7777)
+    os.utime(dest, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def link_or_copy_file(src: Path, dest: Path) -> None:
+    """Atomically make `dest` a hardlink to `src`, copying where links fail."""
+    try:
+        if dest.exists() and os.path.samefile(src, dest):
+            return
+    except OSError:
+        pass
+    temp_path = dest.with_name(f'{dest.name}.{os.getpid()}.part')
+    temp_path.unlink(missing_ok=True)
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        # Cross-device or unsupported: fall back to a (possibly reflinked) copy.
+        copy_file_preserving(src, temp_path)
+    os.replace(temp_path, dest)
+
+
+def write_text_atomic(path: Path, text: str, mode: Optional[int] = None) -> None:
+    """Replace `path` with new content via a temp file and rename.
+
+    Staged and cached files may be hardlinks into other caches, so they are
+    never rewritten in place; the rename gives `path` its own inode. The
+    previous file's mode is kept unless `mode` is given.
+    """
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    try:
+        os.chmod(temp_path, path.stat().st_mode & 0o7777 if mode is None else mode)
+    except FileNotFoundError:
+        pass
+    os.replace(temp_path, path)
+
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    """Atomically write `path` unless it already holds `text`; report a write."""
+    try:
+        if path.read_text(encoding='utf-8') == text:
+            return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_text_atomic(path, text)
+    return True
+
+
+def expand_directory_pairs(
+    directories: Iterable[tuple[Path, Path]],
+) -> tuple[list[tuple[Path, Path]], list[tuple[Path, Path]]]:
+    """Expand (src, dest) directory trees into (directory pairs, file pairs)."""
+    directory_pairs: list[tuple[Path, Path]] = []
+    file_pairs: list[tuple[Path, Path]] = []
+    for src_root, dest_root in directories:
+        directory_pairs.append((src_root, dest_root))
+        for dirpath, dirnames, filenames in os.walk(src_root):
+            rel = Path(dirpath).relative_to(src_root)
+            for name in dirnames:
+                src_dir = Path(dirpath, name)
+                if src_dir.is_symlink():
+                    file_pairs.append((src_dir, dest_root / rel / name))
+                else:
+                    directory_pairs.append((src_dir, dest_root / rel / name))
+            file_pairs.extend(
+                (Path(dirpath, name), dest_root / rel / name) for name in filenames
+            )
+    return directory_pairs, file_pairs
+
+
+@dataclass
+class BulkCopy:
+    """Copy files and directory trees in-process for local staging.
+
+    Equivalent to the `mkdir -p`, `cp`, `cp -a src/. dest`, `ln -f` and
+    `cp -al src/. dest` commands that `describe()` prints for dry runs, but every
+    destination directory is created in one pass and no process is spawned per
+    file. Modes and mtimes are kept. The `linked_*` entries are immutable cache
+    artifacts that are hardlinked instead of copied; anything that later
+    rewrites a staged file must replace it (see `write_text_atomic`).
+    """
+
+    files: list[tuple[Path, Path]] = field(default_factory=list[tuple[Path, Path]])
+    directories: list[tuple[Path, Path]] = field(
+        default_factory=list[tuple[Path, Path]]
+    )
+    linked_files: list[tuple[Path, Path]] = field(
+        default_factory=list[tuple[Path, Path]]
+    )
+    linked_directories: list[tuple[Path, Path]] = field(
+        default_factory=list[tuple[Path, Path]]
+    )
+
+    def describe(self) -> list[RunOp]:
+        ops: list[RunOp] = []
+        ops.extend(
+            ensure_directories_exist_ops(
+                {dest for _, dest in chain(self.directories, self.linked_directories)}
+                | {dest.parent for _, dest in chain(self.files, self.linked_files)}
+            )
+        )
+        ops.extend(
+            ['cp', '-al', f'{src.as_posix()}/.', dest.as_posix()]
+            for src, dest in self.linked_directories
+        )
+        ops.extend(
+            ['ln', '-f', src.as_posix(), dest.as_posix()]
+            for src, dest in self.linked_files
+        )
+        ops.extend(
+            ['cp', '-a', f'{src.as_posix()}/.', dest.as_posix()]
+            for src, dest in self.directories
+        )
+        ops.extend(['cp', src.as_posix(), dest.as_posix()] for src, dest in self.files)
+        return ops
+
+    def expand(
+        self,
+    ) -> tuple[list[tuple[Path, Path]], dict[Path, tuple[Path, bool]]]:
+        """Return (directory pairs, destination file -> (source, linked))."""
+        directory_pairs, file_pairs = expand_directory_pairs(self.directories)
+        linked_directory_pairs, linked_file_pairs = expand_directory_pairs(
+            self.linked_directories
+        )
+        directory_pairs.extend(linked_directory_pairs)
+        entries = {
+            dest: (src, True)
+            for src, dest in chain(linked_file_pairs, self.linked_files)
+        }
+        entries.update(
+            (dest, (src, False)) for src, dest in chain(file_pairs, self.files)
+        )
+        return directory_pairs, entries
+
+    @staticmethod
+    def make_directories(directories: Iterable[Path]) -> None:
+        for directory in sorted(set(directories)):
+            if directory.is_symlink() or (
+                directory.exists() and not directory.is_dir()
+            ):
+                directory.unlink()
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def copy_entries(entries: dict[Path, tuple[Path, bool]]) -> None:
+        for dest, (src, linked) in sorted(entries.items()):
+            if dest.is_dir() and not dest.is_symlink():
+                shutil.rmtree(dest)
+            if linked:
+                link_or_copy_file(src, dest)
+            else:
+                copy_file_preserving(src, dest)
+
+    @staticmethod
+    def restore_directory_stats(directory_pairs: list[tuple[Path, Path]]) -> None:
+        # Run after all file writes (deepest first) so they don't bump mtimes.
+        for src, dest in sorted(directory_pairs, key=lambda p: p[1], reverse=True):
+            source_stat, staged_stat = src.stat(), dest.stat()
+            if staged_stat.st_mode & 0o7777 != source_stat.st_mode & 0o7777:
+                os.chmod(dest, source_stat.st_mode & 0o7777)
+            if staged_stat.st_mtime_ns != source_stat.st_mtime_ns:
+                os.utime(dest, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+    def __call__(self) -> None:
+        directory_pairs, entries = self.expand()
+        self.make_directories(
+            chain(
+                (dest for _, dest in directory_pairs),
+                (dest.parent for dest in entries),
+            )
+        )
+        self.copy_entries(entries)
+        self.restore_directory_stats(directory_pairs)
+
+
+def copy_directories_local(
+    source_root: Path | str,
+    source_dirs: Iterable[str],
+    dest_root: Path | str,
+    dest_dirs: Iterable[str],
+) -> list[RunOp]:
+    src_root_path = source_root if isinstance(source_root, Path) else Path(source_root)
+    dest_root_path = dest_root if isinstance(dest_root, Path) else Path(dest_root)
+    source_dir_list = list(source_dirs)
+    dest_dir_list = list(dest_dirs)
+
+    ops: list[RunOp] = []
+    ops.extend(
+        ensure_directories_exist_ops({(dest_root_path / d) for d in dest_dir_list})
+    )
+    ops.extend(
+        [
+            [
+                'cp',
+                '-a',
+                (src_root_path / src).as_posix() + '/.',
+                (dest_root_path / dest).as_posix(),
+            ]
+            for src, dest in zip(source_dir_list, dest_dir_list)
+        ]
+    )
+
+    return ops
 
 
 def parse_jsonnet_now(
     jsonnet_file: Path, ext_vars: dict[str, str], output_string: bool = False
 ) -> dict[str, Any] | list[Any] | str:
     try:
+        output = get_jsonnet_backend().evaluate(
+            jsonnet_file, ext_vars, output_string=output_string
+        )
+        return output if output_string else json.loads(output)
+    except (subprocess.CalledProcessError, RuntimeError) as e:
+        print(
+            f'Error running jsonnet command: {make_shell_command(parse_jsonnet(jsonnet_file, ext_vars, None))}'
+        )
+        print(f'Error details: {getattr(e, "stderr", None) or e}')
+        raise
+
+
+def read_memoized_jsonnet(
+    cache_path: Path, jsonnet_file: Path, ext_vars: dict[str, str]
+) -> Optional[Any]:
+    """Return the value memoized by write_memoized_jsonnet if its inputs are unchanged."""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict) or 'value' not in data:
+        return None
+    record = cast(dict[str, Any], data)
+
+    merge_source_fingerprints(record.get('source_fingerprints'))
+    inputs = [CWD / p for p in record.get('imports', [])]
+    if not inputs or not all(p.is_file() for p in inputs):
+        return None
+    digest = compute_jsonnet_entry_digest(
+        cache_relative_path(jsonnet_file),
+        '',
+        False,
+        inputs,
+        record.get('ext_vars', []),
+        ext_vars,
+    )
+    return record['value'] if digest == record.get('digest') else None
+
+
+def write_memoized_jsonnet(
+    cache_path: Path, jsonnet_file: Path, ext_vars: dict[str, str], value: Any
+) -> None:
+    """Persist an evaluated Jsonnet value with the digest of its import closure."""
+    inputs, ext_var_keys = jsonnet_import_closure(jsonnet_file)
+    record = {
+        'digest': compute_jsonnet_entry_digest(
+            cache_relative_path(jsonnet_file),
+            '',
+            False,
+            inputs,
+            ext_var_keys,
+            ext_vars,
+        ),
+        'imports': [cache_relative_path(p) for p in inputs],
+        'ext_vars': ext_var_keys,
+        'source_fingerprints': snapshot_source_fingerprints(),
+        'value': value,
+    }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(temp_path, cache_path)
+
+
+def jsonnet_output_is_string(
+    output_path: Optional[Path], output_string: bool = False
+) -> bool:
+    """Mirror parse_jsonnet's choice of `-S` for an output destination."""
+    return output_string or bool(
+        output_path and (output_path.suffix == '.sh' or output_path.suffix == '.ini')
+    )
+
+
+JSONNET_STRING_ESCAPES = {
+    '"': '\\"',
+    '\\': '\\\\',
+    '\b': '\\b',
+    '\f': '\\f',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+}
+
+
+def load_jsonnet_json(text: str) -> Any:
+    """Parse manifested Jsonnet output, keeping every number a double like
+    Jsonnet does (so '-0' survives a round trip through manifest_jsonnet_json)."""
+    return json.loads(text, parse_int=float)
+
+
+def manifest_jsonnet_json(value: Any, indent: str = '') -> str:
+    """Serialize `value` exactly as the jsonnet CLI manifests JSON output."""
+    inner = indent + '   '
+    if isinstance(value, dict):
+        items = cast(dict[str, Any], value)
+        if not items:
+            return '{ }'
+        fields_text = ',\n'.join(
+            f'{inner}{manifest_jsonnet_json(k)}: {manifest_jsonnet_json(v, inner)}'
+            for k, v in items.items()
+        )
+        return '{\n' + fields_text + '\n' + indent + '}'
+    if isinstance(value, list):
+        elements = cast(list[Any], value)
+        if not elements:
+            return '[ ]'
+        elements_text = ',\n'.join(
+            inner + manifest_jsonnet_json(v, inner) for v in elements
+        )
+        return '[\n' + elements_text + '\n' + indent + ']'
+    if isinstance(value, str):
+        escaped: list[str] = []
+        for ch in value:
+            code = ord(ch)
+            if ch in JSONNET_STRING_ESCAPES:
+                escaped.append(JSONNET_STRING_ESCAPES[ch])
+            elif code < 0x20 or 0x7F <= code <= 0x9F:
+                escaped.append(f'\\u{code:04x}')
+            else:
+                escaped.append(ch)
+        return '"' + ''.join(escaped) + '"'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if isinstance(value, float) and value != int(value):
+        return f'{value:.17g}'
+    return f'{value:.0f}'
+
+
+# Appended to an import path to request that host's ext-var-substituted copy.
+JSONNET_HOST_TAG = '@@'
+
+
+class JsonnetBackend(ABC):
+    """Evaluates Jsonnet files with the same output semantics as the jsonnet CLI."""
+
+    name: str
+
+    @abstractmethod
+    def evaluate(
+        self, jsonnet_file: Path, ext_vars: dict[str, str], output_string: bool = False
+    ) -> str:
+        """Return what `jsonnet [-S] file` would print to stdout."""
+
+    @abstractmethod
+    def render_to_path(
+        self,
+        jsonnet_file: Path,
+        ext_vars: dict[str, str],
+        output_path: Path,
+        is_multicast: bool = False,
+        output_string: bool = False,
+    ) -> None:
+        """Write what `jsonnet [-S] (-o|-m) output_path file` would write."""
+
+
+class CliJsonnetBackend(JsonnetBackend):
+    """Runs the jsonnet executable once per evaluation."""
+
+    name = 'cli'
+
+    def evaluate(
+        self, jsonnet_file: Path, ext_vars: dict[str, str], output_string: bool = False
+    ) -> str:
         result = subprocess.run(
             parse_jsonnet(jsonnet_file, ext_vars, None, output_string=output_string),
             capture_output=True,
             check=True,
             text=True,
         )
-        return result.stdout if output_string else json.loads(result.stdout)
-    except subprocess.CalledProcessError as e:
-        print(
-            f'Error running jsonnet command: {make_shell_command(parse_jsonnet(jsonnet_file, ext_vars, None))}'
+        return result.stdout
+
+    def render_to_path(
+        self,
+        jsonnet_file: Path,
+        ext_vars: dict[str, str],
+        output_path: Path,
+        is_multicast: bool = False,
+        output_string: bool = False,
+    ) -> None:
+        subprocess.run(
+            parse_jsonnet(
+                jsonnet_file,
+                ext_vars,
+                output_path,
+                is_multicast=is_multicast,
+                output_string=output_string,
+            ),
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+
+
+class BindingJsonnetBackend(JsonnetBackend):
+    """Evaluates in-process through the `_jsonnet` Python binding.
+
+    The binding only returns manifested JSON, so `-S` and `-m` are emulated:
+    string results are written raw with a trailing newline, and multi-output
+    objects are split into one file per field.
+    """
+
+    name = 'binding'
+
+    def __init__(self, module: Any) -> None:
+        self._jsonnet = module
+
+    def _evaluate_value(self, jsonnet_file: Path, ext_vars: dict[str, str]) -> Any:
+        return load_jsonnet_json(
+            self._jsonnet.evaluate_file(jsonnet_file.as_posix(), ext_vars=ext_vars)
+        )
+
+    @staticmethod
+    def _manifest(value: Any, output_string: bool) -> str:
+        if not output_string:
+            return manifest_jsonnet_json(value) + '\n'
+        if not isinstance(value, str):
+            raise RuntimeError(
+                f'RUNTIME ERROR: expected string result, got: {type(value).__name__}'
+            )
+        return value + '\n'
+
+    def evaluate(
+        self, jsonnet_file: Path, ext_vars: dict[str, str], output_string: bool = False
+    ) -> str:
+        if not output_string:
+            return self._jsonnet.evaluate_file(
+                jsonnet_file.as_posix(), ext_vars=ext_vars
+            )
+        return self._manifest(
+            self._evaluate_value(jsonnet_file, ext_vars), output_string
         )
-        print(f'Error details: {e.stderr}')
-        raise
+
+    def render_to_path(
+        self,
+        jsonnet_file: Path,
+        ext_vars: dict[str, str],
+        output_path: Path,
+        is_multicast: bool = False,
+        output_string: bool = False,
+    ) -> None:
+        string_output = jsonnet_output_is_string(output_path, output_string)
+        if not is_multicast:
+            write_text_atomic(
+                output_path,
+                self.evaluate(jsonnet_file, ext_vars, output_string=string_output),
+            )
+            return
+
+        value = self._evaluate_value(jsonnet_file, ext_vars)
+        if not isinstance(value, dict):
+            raise RuntimeError(
+                f'RUNTIME ERROR: multi mode: top-level object was a {type(value).__name__}, should be an object'
+            )
+        for name, content in cast(dict[str, Any], value).items():
+            write_text_atomic(
+                output_path / name, self._manifest(content, string_output)
+            )
+
+    def render_manifest(self, tasks: Sequence[JsonnetTask]) -> None:
+        """Render every task, across hosts, from one generated top-level program.
+
+        The program maps hostname -> entry -> `import` of that entry. Files
+        whose import closure reads no ext vars are imported by their real
+        path, so Jsonnet's import cache shares them across entries and hosts.
+        Files that do read ext vars are imported as `path@@hostname`; the
+        import callback serves those with each std.extVar() replaced by the
+        host's value, and tags their host-dependent imports the same way.
+        Comments and string literals are left as written. Entries whose
+        closure calls std.extVar() with a computed key cannot be rewritten and
+        are evaluated on their own, once per host, with real ext vars.
+        """
+        batched: list[JsonnetTask] = []
+        for task in tasks:
+            if JSONNET_ANY_EXT_VAR in jsonnet_import_closure(task.jsonnet_file)[1]:
+                self.render_to_path(
+                    task.jsonnet_file,
+                    task.ext_vars,
+                    task.output_path,
+                    is_multicast=task.is_multicast,
+                    output_string=task.output_string,
+                )
+            else:
+                batched.append(task)
+        if not batched:
+            return
+        tasks = batched
+        host_ext_vars = {task.hostname: task.ext_vars for task in tasks}
+
+        def is_host_dependent(path: Path) -> bool:
+            return bool(jsonnet_import_closure(path)[1])
+
+        def host_source(path: Path, hostname: str) -> str:
+            ext_vars = host_ext_vars[hostname]
+
+            def rewrite(match: re.Match[str]) -> str:
+                if match.group('ext_var'):
+                    key = match.group('key')
+                    return json.dumps(ext_vars[key]) if key in ext_vars else match[0]
+                if not match.group('import') or match.group('kind') != 'import':
+                    return match.group(0)
+                target = match.group('target')
+                resolved = Path(os.path.normpath(path.parent / target))
+                if not resolved.is_file() or not is_host_dependent(resolved):
+                    return match.group(0)
+                quote = match.group('import_quote')
+                return f'import {quote}{target}{JSONNET_HOST_TAG}{hostname}{quote}'
+
+            text = path.read_text(encoding='utf-8')
+            return JSONNET_TOKEN_PATTERN.sub(rewrite, text)
+
+        def import_callback(directory: str, rel: str) -> tuple[str, bytes]:
+            rel_path, _, hostname = rel.partition(JSONNET_HOST_TAG)
+            path = Path(os.path.normpath(Path(directory) / rel_path))
+            if not hostname:
+                return path.as_posix(), path.read_bytes()
+            # Keep the real directory so relative imports resolve (and cache) as usual.
+            found_here = f'{path.as_posix()}{JSONNET_HOST_TAG}{hostname}'
+            return found_here, host_source(path, hostname).encode('utf-8')
+
+        program: list[str] = ['{']
+        for hostname in host_ext_vars:
+            program.append(f'  {json.dumps(hostname)}: {{')
+            for task in tasks:
+                if task.hostname != hostname:
+                    continue
+                import_path = task.jsonnet_file.as_posix()
+                if is_host_dependent(task.jsonnet_file):
+                    import_path += JSONNET_HOST_TAG + hostname
+                program.append(
+                    f'    {json.dumps(task.src)}: import {json.dumps(import_path)},'
+                )
+            program.append('  },')
+        program.append('}')
+
+        manifest = load_jsonnet_json(
+            self._jsonnet.evaluate_snippet(
+                (CWD / 'jsonnet_batch.jsonnet').as_posix(),
+                '\n'.join(program),
+                import_callback=import_callback,
+            )
+        )
+
+        for task in tasks:
+            value = manifest[task.hostname][task.src]
+            string_output = jsonnet_output_is_string(
+                task.output_path, task.output_string
+            )
+            if not task.is_multicast:
+                write_text_atomic(
+                    task.output_path, self._manifest(value, string_output)
+                )
+                continue
+            if not isinstance(value, dict):
+                raise RuntimeError(
+                    f'RUNTIME ERROR: multi mode: top-level object was a {type(value).__name__}, should be an object'
+                )
+            for name, content in cast(dict[str, Any], value).items():
+                write_text_atomic(
+                    task.output_path / name, self._manifest(content, string_output)
+                )
+
+
+@cache
+def get_jsonnet_backend() -> JsonnetBackend:
+    """Prefer the in-process binding; DOTFILES_JSONNET_BACKEND=cli forces the CLI."""
+    if os.environ.get('DOTFILES_JSONNET_BACKEND', '').lower() != 'cli':
+        try:
+            import _jsonnet  # type: ignore[import-not-found]
+
+            return BindingJsonnetBackend(_jsonnet)
+        except ImportError:
+            pass
+    return CliJsonnetBackend()
 
 
 def parse_jsonnet(
@@ -951,9 +2528,7 @@ def parse_jsonnet(
 ) -> list[str]:
     proc_args = [find_jsonnet_command()]
 
-    if output_string or (
-        output_path and (output_path.suffix == '.sh' or output_path.suffix == '.ini')
-    ):
+    if jsonnet_output_is_string(output_path, output_string):
         proc_args.append('-S')
 
     if output_path:
@@ -991,99 +2566,843 @@ def get_ext_vars(host: Optional[Host] = None) -> dict[str, str]:
     return standard_ext_vars
 
 
-def preprocess_curl_files(host: Host, verbose: bool = False) -> list[RunOp]:
+# Comments and string literals are matched as whole tokens so that import and
+# std.extVar text inside them is never mistaken for code. `dynamic_ext_var`
+# catches any std.extVar use whose key is not a string literal.
+JSONNET_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|\#[^\n]*|/\*.*?\*/)
+    |(?P<import>(?<![\w.])(?P<kind>import|importstr|importbin)\s*
+        (?P<import_quote>['"])(?P<target>[^\n]+?)(?P=import_quote))
+    |(?P<ext_var>\bstd\.extVar\(\s*(?P<key_quote>['"])(?P<key>[^\n]+?)(?P=key_quote)\s*\))
+    |(?P<dynamic_ext_var>\bstd\s*\.\s*extVar\b)
+    |(?P<string>\|\|\|.*?\|\|\||@'(?:[^']|'')*'|@"(?:[^"]|"")*"
+        |'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Stands in for "every ext var" when a closure reads std.extVar with a computed key.
+JSONNET_ANY_EXT_VAR = '*'
+
+
+@dataclass
+class JsonnetSourceDeps:
+    imports: list[Path]
+    data_imports: list[Path]
+    ext_vars: list[str]
+
+
+_jsonnet_source_deps: dict[Path, JsonnetSourceDeps] = {}
+
+
+def scan_jsonnet_source(path: Path) -> JsonnetSourceDeps:
+    """Return the direct imports and ext var keys referenced by a Jsonnet file.
+
+    Import paths must be string literals in Jsonnet, so a lexical scan is
+    sufficient; comments and strings are skipped, and imports that don't
+    resolve to a file are dropped. A std.extVar() whose key is not a string
+    literal is reported as JSONNET_ANY_EXT_VAR. Results are memoized for the
+    lifetime of the process.
+    """
+    cached = _jsonnet_source_deps.get(path)
+    if cached is not None:
+        return cached
+
+    text = path.read_text(encoding='utf-8')
+    imports: list[Path] = []
+    data_imports: list[Path] = []
+    ext_vars: set[str] = set()
+    for match in JSONNET_TOKEN_PATTERN.finditer(text):
+        if match.group('import'):
+            target = Path(os.path.normpath(path.parent / match.group('target')))
+            if not target.is_file():
+                continue
+            kind = match.group('kind')
+            (imports if kind == 'import' else data_imports).append(target)
+        elif match.group('ext_var'):
+            ext_vars.add(match.group('key'))
+        elif match.group('dynamic_ext_var'):
+            ext_vars.add(JSONNET_ANY_EXT_VAR)
+
+    deps = JsonnetSourceDeps(imports, data_imports, sorted(ext_vars))
+    _jsonnet_source_deps[path] = deps
+    return deps
+
+
+def jsonnet_import_closure(entry: Path) -> tuple[list[Path], list[str]]:
+    """Return the transitive inputs of a Jsonnet entry and the ext var keys they read."""
+    seen: set[Path] = set()
+    ext_var_keys: set[str] = set()
+    pending = [Path(os.path.normpath(entry))]
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        deps = scan_jsonnet_source(current)
+        ext_var_keys.update(deps.ext_vars)
+        seen.update(deps.data_imports)
+        pending.extend(deps.imports)
+    return sorted(seen), sorted(ext_var_keys)
+
+
+JSONNET_SOURCE_SUFFIXES = ('.jsonnet', '.libsonnet')
+PRUNED_SOURCE_DIR_NAMES = {'.git', '.venv', 'node_modules'}
+
+_jsonnet_source_files: dict[Path, list[Path]] = {}
+
+
+def jsonnet_source_files(root: Path) -> list[Path]:
+    """Return every *.jsonnet/*.libsonnet file under `root`, sorted.
+
+    Walks the tree once per process, pruning OUT_DIR_ROOT and tool/VCS
+    directories without descending into them. The result is shared by all hosts.
+    """
+    cached = _jsonnet_source_files.get(root)
+    if cached is not None:
+        return cached
+
+    out_root = os.fspath(OUT_DIR_ROOT)
+    found: list[Path] = []
+    pending = [os.fspath(root)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if (
+                        entry.name not in PRUNED_SOURCE_DIR_NAMES
+                        and entry.path != out_root
+                    ):
+                        pending.append(entry.path)
+                elif entry.name.endswith(JSONNET_SOURCE_SUFFIXES):
+                    found.append(Path(entry.path))
+
+    found.sort()
+    _jsonnet_source_files[root] = found
+    return found
+
+
+def cache_relative_path(path: Path) -> str:
+    """Return `path` relative to CWD when possible, for storing in cache files."""
+    try:
+        return path.relative_to(CWD).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def compute_jsonnet_entry_digest(
+    src: str,
+    dest: str,
+    is_multicast: bool,
+    inputs: Iterable[Path],
+    ext_var_keys: Iterable[str],
+    ext_vars: dict[str, str],
+) -> str:
+    """Hash a Jsonnet entry's output spec, input contents and the ext vars it reads."""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([src, dest, is_multicast]).encode('utf-8'))
+    keys = set(ext_var_keys)
+    if JSONNET_ANY_EXT_VAR in keys:
+        keys = set(ext_vars)
+    for key in sorted(keys):
+        hasher.update(json.dumps([key, ext_vars.get(key)]).encode('utf-8'))
+    for path in sorted(inputs):
+        hasher.update(cache_relative_path(path).encode('utf-8'))
+        hasher.update(file_content_digest(path).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+# Recorded (size, mtime_ns, inode, sha256) per source path, persisted in cache.json.
+_source_fingerprints: dict[str, list[Any]] = {}
+_verified_sources: set[str] = set()
+
+# Files modified this recently may still change within the filesystem's mtime
+# granularity, so their fingerprints aren't trusted on the next run.
+RACY_FINGERPRINT_WINDOW_NS = 2_000_000_000
+
+
+def file_content_digest(path: Path) -> str:
+    """Return the SHA-256 of `path`, re-reading it only if its stat fingerprint changed.
+
+    With --verify-cache, recorded fingerprints are ignored and each file is
+    rehashed once per process.
+    """
+    key = cache_relative_path(path)
+    stat = path.stat()
+    fingerprint = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    record = _source_fingerprints.get(key)
+    trusted = not VERIFY_CACHE_FLAG or key in _verified_sources
+    if trusted and record is not None and record[:3] == fingerprint:
+        return cast(str, record[3])
+
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _source_fingerprints[key] = [*fingerprint, digest]
+    _verified_sources.add(key)
+    return digest
+
+
+def merge_source_fingerprints(records: Any) -> None:
+    """Seed the in-process fingerprint table from a persisted cache.json table."""
+    if not isinstance(records, dict):
+        return
+    for key, record in cast(dict[Any, Any], records).items():
+        if (
+            isinstance(key, str)
+            and key not in _source_fingerprints
+            and isinstance(record, list)
+            and len(cast(list[Any], record)) == 4
+        ):
+            _source_fingerprints[key] = cast(list[Any], record)
+
+
+def snapshot_source_fingerprints() -> dict[str, list[Any]]:
+    """Return the fingerprint table to persist, dropping racily-recent entries."""
+    cutoff = time.time_ns() - RACY_FINGERPRINT_WINDOW_NS
+    return {
+        key: record
+        for key, record in sorted(_source_fingerprints.items())
+        if record[1] < cutoff
+    }
+
+
+HTTP_REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+HTTP_MAX_REDIRECTS = 10
+
+HttpOrigin: TypeAlias = tuple[str, str, int]
+
+
+class HttpConnectionPool:
+    """Keep-alive HTTP(S) connections shared by download workers, keyed by origin.
+
+    A worker checks a connection out for one request and returns it afterwards,
+    so at most one connection per concurrent worker is open to each origin and
+    most URLs on the same host reuse an existing TLS session.
+    """
+
+    def __init__(self, timeout: float = 60) -> None:
+        self.timeout = timeout
+        self._idle: dict[HttpOrigin, list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> HttpConnectionPool:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle = [c for conns in self._idle.values() for c in conns]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def _acquire(self, origin: HttpOrigin) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+        scheme, hostname, port = origin
+        if scheme == 'https':
+            return http.client.HTTPSConnection(
+                hostname, port, timeout=self.timeout
+            ), False
+        return http.client.HTTPConnection(hostname, port, timeout=self.timeout), False
+
+    def _release(
+        self, origin: HttpOrigin, connection: http.client.HTTPConnection
+    ) -> None:
+        with self._lock:
+            self._idle.setdefault(origin, []).append(connection)
+
+    def _request(
+        self, url: str, headers: dict[str, str]
+    ) -> tuple[int, http.client.HTTPMessage, bytes]:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Unsupported download URL: {url}')
+        default_port = 443 if parts.scheme == 'https' else 80
+        origin = (parts.scheme, parts.hostname, parts.port or default_port)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        while True:
+            connection, reused = self._acquire(origin)
+            try:
+                connection.request('GET', target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connection.close()
+                # The server may have dropped an idle keep-alive connection.
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(origin, connection)
+            return response.status, response.headers, body
+
+    def get(
+        self, url: str, headers: dict[str, str]
+    ) -> tuple[int, http.client.HTTPMessage, bytes]:
+        """GET `url`, following redirects like `curl -L`."""
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(url, headers)
+            location = response_headers.get('Location')
+            if status not in HTTP_REDIRECT_STATUSES or not location:
+                return status, response_headers, body
+            url = urllib.parse.urljoin(url, location)
+        raise RuntimeError(f'Too many redirects while downloading {url}')
+
+
+SHA256_HEX_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def normalize_sha256_digest(value: str) -> str:
+    """Accept 'sha256:<hex>' or bare hex and return lowercase hex."""
+    digest = value.strip().lower().removeprefix('sha256:')
+    if not SHA256_HEX_PATTERN.fullmatch(digest):
+        raise ValueError(f'Invalid sha256 digest: {value!r}')
+    return digest
+
+
+@contextmanager
+def exclusive_file_lock(lock_path: Path) -> Iterator[None]:
+    """Hold an exclusive flock on `lock_path` across apply.py processes.
+
+    Platforms without fcntl (native Windows) run unlocked.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(lock_path, 'a', encoding='utf-8') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class CurlStore:
+    """Content-addressed download store shared by every host (`out/cas`).
+
+    Bodies are kept once as `<sha256>` files and the index maps each URL to
+    its current digest plus the ETag/Last-Modified/fetch time used to
+    revalidate it. Host curl directories hold hardlinks to these blobs. Each
+    URL is downloaded at most once per run: fetches of one URL take a per-URL
+    lock (a thread lock plus a flock under `locks/`) and recheck the index
+    before going to the network.
+    """
+
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+        # URLs downloaded or revalidated by this process; never fetched twice.
+        self._fetched_urls: set[str] = set()
+        self._url_locks: dict[str, threading.Lock] = {}
+        self.opened_at = time.time()
+        self.index = self._read_index()
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / self.INDEX_NAME
+
+    def _read_index(self) -> dict[str, dict[str, Any]]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {
+            url: dict(cast(dict[str, Any], record))
+            for url, record in cast(dict[Any, Any], data).items()
+            if isinstance(url, str) and isinstance(record, dict)
+        }
+
+    def save(self) -> None:
+        # Other apply.py processes (parallel host pipelines) share this index,
+        # so only the entries this process fetched overwrite what is on disk.
+        self.root.mkdir(parents=True, exist_ok=True)
+        with exclusive_file_lock(self.index_path.with_name(f'{self.INDEX_NAME}.lock')):
+            on_disk = self._read_index()
+            with self._lock:
+                on_disk.update({url: self.index[url] for url in self._fetched_urls})
+                self.index = on_disk
+                snapshot = json.dumps(self.index, indent=4, sort_keys=True)
+            temp_path = self.index_path.with_name(
+                f'{self.INDEX_NAME}.{os.getpid()}.{threading.get_ident()}.tmp'
+            )
+            temp_path.write_text(snapshot, encoding='utf-8')
+            os.replace(temp_path, self.index_path)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / digest
+
+    @contextmanager
+    def url_guard(self, url: str) -> Iterator[None]:
+        """Serialize fetches of `url` across threads and apply.py processes."""
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        lock_dir = self.root / 'locks'
+        with url_lock:
+            lock_dir.mkdir(parents=True, exist_ok=True)
+            url_digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+            with exclusive_file_lock(lock_dir / f'{url_digest}.lock'):
+                yield
+
+    def refresh(self, url: str) -> None:
+        """Adopt the on-disk record for `url` if another process fetched it
+        after this store was opened, so it counts as fetched this run."""
+        record = self._read_index().get(url)
+        fetched_at = record.get('fetched_at') if record else None
+        if not isinstance(fetched_at, (int, float)) or fetched_at < self.opened_at:
+            return
+        with self._lock:
+            self.index[url] = cast(dict[str, Any], record)
+            self._fetched_urls.add(url)
+
+    def record(self, url: str) -> dict[str, Any]:
+        with self._lock:
+            return dict(self.index.get(url, {}))
+
+    def cached_blob(self, url: str) -> Optional[Path]:
+        digest = self.record(url).get('digest')
+        if not isinstance(digest, str):
+            return None
+        blob = self.blob_path(digest)
+        return blob if blob.is_file() else None
+
+    def resolve(self, url: str, pinned_digest: Optional[str] = None) -> Optional[Path]:
+        """Return the blob that can be used for `url` without touching the network.
+
+        A pinned digest is trusted whenever its blob is present; otherwise the
+        indexed blob is used if it was fetched this run or within the TTL.
+        """
+        if pinned_digest is not None:
+            blob = self.blob_path(pinned_digest)
+            return blob if blob.is_file() else None
+        blob = self.cached_blob(url)
+        if blob is None:
+            return None
+        with self._lock:
+            if url in self._fetched_urls:
+                return blob
+        fetched_at = self.record(url).get('fetched_at')
+        if (
+            isinstance(fetched_at, (int, float))
+            and time.time() - fetched_at < CURL_CACHE_TTL_SECONDS
+        ):
+            return blob
+        return None
+
+    def fetched_this_run(self, url: str) -> bool:
+        with self._lock:
+            return url in self._fetched_urls
+
+    def add(
+        self,
+        url: str,
+        body: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Path:
+        digest = hashlib.sha256(body).hexdigest()
+        blob = self.blob_path(digest)
+        if not blob.is_file():
+            self.root.mkdir(parents=True, exist_ok=True)
+            temp_path = blob.with_name(
+                f'{digest}.{os.getpid()}.{threading.get_ident()}.part'
+            )
+            temp_path.write_bytes(body)
+            os.replace(temp_path, blob)
+        with self._lock:
+            self.index[url] = {
+                'digest': digest,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': time.time(),
+            }
+            self._fetched_urls.add(url)
+        return blob
+
+    def touch(self, url: str) -> None:
+        """Record a successful revalidation (304) of `url`."""
+        with self._lock:
+            self.index.setdefault(url, {})['fetched_at'] = time.time()
+            self._fetched_urls.add(url)
+
+
+@cache
+def get_curl_store() -> CurlStore:
+    return CurlStore(OUT_DIR_ROOT / 'cas')
+
+
+@dataclass
+class CurlFetch:
+    """Make one curl_maps download available at `dest` via the shared store.
+
+    The body comes from the store when a pinned digest is present there or the
+    URL is still fresh; otherwise it is requested with the recorded
+    ETag/Last-Modified as If-None-Match/If-Modified-Since, where a 304 keeps
+    the stored body. Like `curl -fL`, redirects are followed and HTTP errors
+    fail the fetch. `revalidate` skips the TTL check but not the pinned or
+    fetched-this-run shortcuts.
+    """
+
+    url: str
+    dest: Path
+    store: CurlStore
+    pinned_digest: Optional[str] = None
+    revalidate: bool = False
+    verbose: bool = False
+    bytes_moved: int = field(default=0, init=False)
+
+    def reusable_blob(self) -> Optional[Path]:
+        if self.revalidate and self.pinned_digest is None:
+            blob = self.store.cached_blob(self.url)
+            return blob if blob and self.store.fetched_this_run(self.url) else None
+        return self.store.resolve(self.url, self.pinned_digest)
+
+    def conditional_headers(self) -> dict[str, str]:
+        if self.store.cached_blob(self.url) is None:
+            return {}
+        record = self.store.record(self.url)
+        if self.pinned_digest not in (None, record.get('digest')):
+            # A 304 would keep a stored body that does not match the pin.
+            return {}
+        headers: dict[str, str] = {}
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def curl_command(self) -> RunCmd:
+        blob = self.reusable_blob()
+        if blob is not None:
+            return ['ln', '-f', blob.as_posix(), self.dest.as_posix()]
+        flags = ['-fL'] if self.verbose else ['-fL', '-s', '-S']
+        for name, value in self.conditional_headers().items():
+            flags.extend(['-H', f'{name}: {value}'])
+        return ['curl', *flags, '-o', self.dest.as_posix(), self.url]
+
+    def describe(self) -> list[RunOp]:
+        return [self.curl_command()]
+
+    def __call__(self, pool: Optional[HttpConnectionPool] = None) -> None:
+        blob = self.reusable_blob()
+        if blob is None:
+            # A concurrent fetch of the same URL (another host's curl node, or
+            # another host pipeline process) waits here and then reuses the
+            # blob the first one stored instead of downloading it again.
+            with self.store.url_guard(self.url):
+                self.store.refresh(self.url)
+                blob = self.reusable_blob()
+                if blob is None:
+                    blob = self.download(pool)
+                    self.store.save()
+        link_or_copy_file(blob, self.dest)
+
+    def download(self, pool: Optional[HttpConnectionPool] = None) -> Path:
+        if pool is None:
+            with HttpConnectionPool(CURL_TIMEOUT_SECONDS) as own_pool:
+                return self.download(own_pool)
+
+        headers = {'User-Agent': 'dotFiles-apply', **self.conditional_headers()}
+        try:
+            status, response_headers, body = pool.get(self.url, headers)
+        except (OSError, http.client.HTTPException) as e:
+            print(f'ERROR: Failed to download {self.url} -> {self.dest} ({e})')
+            raise
+
+        if status == 304 and (blob := self.store.cached_blob(self.url)):
+            self.store.touch(self.url)
+            if self.verbose:
+                print(f'Not modified: {self.url}')
+            return blob
+        if status >= 300:
+            print(
+                f'ERROR: Failed to download {self.url} -> {self.dest} (HTTP {status})'
+            )
+            raise RuntimeError(f'HTTP {status} while downloading {self.url}')
+        if not body:
+            raise ValueError(f'ERROR: Failed to download {self.url} -> {self.dest}')
+        digest = hashlib.sha256(body).hexdigest()
+        if self.pinned_digest is not None and digest != self.pinned_digest:
+            print(
+                f'ERROR: Digest mismatch for {self.url}: '
+                f'expected sha256:{self.pinned_digest}, got sha256:{digest}'
+            )
+            raise ValueError(f'Pinned digest mismatch for {self.url}')
+        blob = self.store.add(
+            self.url,
+            body,
+            etag=response_headers.get('ETag'),
+            last_modified=response_headers.get('Last-Modified'),
+        )
+        self.bytes_moved = len(body)
+        if self.verbose:
+            print(f'Downloaded {self.url} ({len(body)} bytes)')
+        return blob
+
+
+@dataclass
+class CurlBatchOp:
+    """Download curl_maps entries concurrently over shared keep-alive connections.
+
+    Every fetch runs to completion; failures are reported per URL and then
+    raised together, so one bad URL does not hide the others.
+    """
+
+    fetches: list[CurlFetch]
+    store: CurlStore
+    jobs: int = 1
+
+    @property
+    def bytes_moved(self) -> int:
+        return sum(fetch.bytes_moved for fetch in self.fetches)
+
+    def describe(self) -> list[RunOp]:
+        return [fetch.curl_command() for fetch in self.fetches]
+
+    def __call__(self) -> None:
+        def run(fetch: CurlFetch) -> Optional[Exception]:
+            try:
+                fetch(pool)
+            except (OSError, ValueError, RuntimeError, http.client.HTTPException) as e:
+                return e
+            return None
+
+        workers = max(1, min(self.jobs, len(self.fetches)))
+        try:
+            with (
+                HttpConnectionPool(CURL_TIMEOUT_SECONDS) as pool,
+                ThreadPoolExecutor(max_workers=workers) as executor,
+            ):
+                results = list(executor.map(run, self.fetches))
+        finally:
+            self.store.save()
+
+        failures = [
+            (fetch, err) for fetch, err in zip(self.fetches, results) if err is not None
+        ]
+        for fetch, error in failures:
+            print(f'Failed downloading {fetch.url} -> {fetch.dest}: {error}')
+        if failures:
+            raise RuntimeError(
+                f'{len(failures)} of {len(self.fetches)} curl downloads failed'
+            )
+
+
+def preprocess_curl_files(
+    host: Host,
+    verbose: bool = False,
+    sources: Optional[Collection[str]] = None,
+    revalidate: bool = False,
+) -> list[RunOp]:
     if not host.curl_maps:
         return [cast(RunOp, 'No curl maps found')]
 
     full_paths = {
-        src: (host.local_curl_dir / dest) for src, dest in host.curl_maps.items()
+        src: (host.local_curl_dir / dest)
+        for src, dest in host.curl_maps.items()
+        if sources is None or src in sources
     }
+    if not full_paths:
+        return [cast(RunOp, 'Curl downloads are up to date')]
+
     ops: list[RunOp] = []
     ops.extend(ensure_directories_exist_ops({p.parent for p in full_paths.values()}))
+    store = get_curl_store()
+    fetches = [
+        CurlFetch(
+            src,
+            dest,
+            store,
+            pinned_digest=host.curl_digests.get(src),
+            revalidate=revalidate,
+            verbose=verbose,
+        )
+        for src, dest in full_paths.items()
+    ]
+    ops.append(CurlBatchOp(fetches, store, jobs=CURL_DOWNLOAD_JOBS))
+    return ops
 
-    # Build robust curl commands that fail on HTTP errors and verify file exists
-    def make_curl_check_cmd(src: str, dest: Path) -> RunCmd:
-        flags = ['-fL']  # fail on HTTP errors, follow redirects
-        if not verbose:
-            flags.extend(['-s', '-S'])  # silent but show errors
-        curl_cmd = ['curl', *flags, '-o', dest.as_posix(), src]
-
-        # Verify the output file is non-empty; remove if invalid
-        quoted_dest = shlex.quote(dest.as_posix())
-        quoted_src = shlex.quote(src)
-        check_snippet = f"[ -s {quoted_dest} ] || {{ echo 'ERROR: Failed to download ' {quoted_src} '->' {quoted_dest} 1>&2; rm -f {quoted_dest}; exit 1; }}"
-        # Use sh -c to chain commands with a post-check
-        return ['sh', '-c', f'{make_shell_command(curl_cmd)} && {check_snippet}']
 
-    ops.extend([make_curl_check_cmd(src, dest) for src, dest in full_paths.items()])
+@dataclass
+class JsonnetTask:
+    hostname: str
+    src: str
+    jsonnet_file: Path
+    ext_vars: dict[str, str]
+    output_path: Path
+    is_multicast: bool = False
+    output_string: bool = False
+
+    def cli_command(self) -> RunCmd:
+        return parse_jsonnet(
+            self.jsonnet_file,
+            self.ext_vars,
+            self.output_path,
+            is_multicast=self.is_multicast,
+            output_string=self.output_string,
+        )
 
-    return ops
+    def output_directory(self) -> Path:
+        return self.output_path if self.is_multicast else self.output_path.parent
 
 
-def preprocess_jsonnet_files(
-    host: Host, source_dir: Path, staging_dir: Path, verbose: bool = False
-) -> list[RunOp]:
-    if not host.jsonnet_maps:
-        return [cast(RunOp, 'No jsonnet maps found')]
+@dataclass
+class JsonnetBatchOp:
+    """Evaluate independent Jsonnet tasks on a bounded worker pool.
 
-    full_paths = [
-        (source_dir / src, staging_dir / dest)
-        for src, dest in host.jsonnet_maps.items()
-    ]
+    Every task runs to completion; failures are reported per entry with the
+    captured error output and then raised together.
+    """
 
-    ops: list[RunOp] = []
-    ops.extend(ensure_directories_exist_ops({p.parent for _, p in full_paths}))
-    jsonnet_commands: list[RunOp] = [
-        parse_jsonnet(src, get_ext_vars(host), dest) for src, dest in full_paths
-    ]
+    tasks: list[JsonnetTask]
+    jobs: int = 1
+    as_manifest: bool = False
+
+    def describe(self) -> list[RunOp]:
+        return [task.cli_command() for task in self.tasks]
+
+    def __call__(self) -> None:
+        backend = get_jsonnet_backend()
+        if self.as_manifest:
+            if isinstance(backend, BindingJsonnetBackend):
+                self._render_manifest(backend)
+                return
+            print(
+                'Batched jsonnet evaluation needs the _jsonnet binding; using the pool'
+            )
 
-    if verbose:
-        annotated_jsonnet_commands: list[RunOp] = [
-            make_shell_command(cast(RunCmd, cmd)) for cmd in jsonnet_commands
-        ]
-        interleaved: list[RunOp] = []
-        for annotation, command in zip(annotated_jsonnet_commands, jsonnet_commands):
-            interleaved.append(annotation)
-            interleaved.append(command)
-        jsonnet_commands = interleaved
+        def run(task: JsonnetTask) -> Optional[str]:
+            try:
+                backend.render_to_path(
+                    task.jsonnet_file,
+                    task.ext_vars,
+                    task.output_path,
+                    is_multicast=task.is_multicast,
+                    output_string=task.output_string,
+                )
+            except subprocess.CalledProcessError as e:
+                return (e.stderr or e.stdout or str(e)).strip()
+            except RuntimeError as e:
+                return str(e).strip()
+            return None
 
-    ops.extend(jsonnet_commands)
-    return ops
+        workers = max(1, min(self.jobs, len(self.tasks)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, self.tasks))
+
+        failures = [(t, err) for t, err in zip(self.tasks, results) if err is not None]
+        for task, error in failures:
+            print(f'Failed running: {make_shell_command(task.cli_command())}')
+            print(f'Error details ({task.hostname}: {task.src}): {error}')
+        if failures:
+            raise RuntimeError(
+                f'{len(failures)} of {len(self.tasks)} jsonnet evaluations failed'
+            )
 
+    def _render_manifest(self, backend: BindingJsonnetBackend) -> None:
+        try:
+            backend.render_manifest(self.tasks)
+        except RuntimeError as e:
+            entries = sorted({f'{t.hostname}: {t.src}' for t in self.tasks})
+            print(f'Failed running batched jsonnet manifest for {entries}')
+            print(f'Error details: {str(e).strip()}')
+            raise
+
+
+def jsonnet_file_tasks(
+    host: Host,
+    source_dir: Path,
+    staging_dir: Path,
+    entries: Optional[Collection[str]] = None,
+) -> list[JsonnetTask]:
+    return [
+        JsonnetTask(
+            host.hostname, src, source_dir / src, get_ext_vars(host), staging_dir / dest
+        )
+        for src, dest in host.jsonnet_maps.items()
+        if entries is None or src in entries
+    ]
 
-def preprocess_jsonnet_directories(
-    host: Host, source_dir: Path, staging_dir: Path, verbose: bool = False
-) -> list[RunOp]:
-    if not host.jsonnet_multi_maps:
-        return [cast(RunOp, 'No jsonnet multimaps found')]
 
-    full_paths: list[tuple[Path, Path]] = [
-        (source_dir / src, staging_dir / dest)
+def jsonnet_directory_tasks(
+    host: Host,
+    source_dir: Path,
+    staging_dir: Path,
+    entries: Optional[Collection[str]] = None,
+) -> list[JsonnetTask]:
+    return [
+        JsonnetTask(
+            host.hostname,
+            src,
+            source_dir / src,
+            get_ext_vars(host),
+            staging_dir / dest,
+            is_multicast=True,
+            output_string=True,
+        )
         for src, dest in host.jsonnet_multi_maps.items()
+        if entries is None or src in entries
     ]
-    staging_dests = {p for _, p in full_paths}
 
+
+def preprocess_jsonnet(
+    hosts: Sequence[Host], verbose: bool = False, skip_cache: bool = False
+) -> list[RunOp]:
+    """Evaluate every stale Jsonnet entry of `hosts` in a single worker pool."""
     ops: list[RunOp] = []
-    ops.extend(ensure_directories_exist_ops(staging_dests))
-    jsonnet_commands: list[RunOp] = [
-        parse_jsonnet(
-            src, get_ext_vars(host), dest, is_multicast=True, output_string=True
-        )
-        for src, dest in full_paths
-    ]
+    tasks: list[JsonnetTask] = []
+    for host in hosts:
+        if not host.jsonnet_maps and not host.jsonnet_multi_maps:
+            ops.append(f'No jsonnet maps found for {host.hostname}')
+            continue
+        if not skip_cache and host.jsonnet_cache_valid:
+            ops.append(
+                f'>> Skipping jsonnet preprocessing for {host.hostname} (no source changes)'
+            )
+            continue
+
+        # Only regenerate entries whose own import closure changed.
+        stale_entries = None if skip_cache else host.stale_jsonnet_entries()
+        if verbose and stale_entries is not None:
+            ops.append(f'Stale jsonnet entries: {sorted(stale_entries)}')
+        host_tasks = jsonnet_file_tasks(
+            host, CWD, host.local_jsonnet_dir, stale_entries
+        ) + jsonnet_directory_tasks(host, CWD, host.local_jsonnet_dir, stale_entries)
+        if not host_tasks:
+            ops.append(f'Jsonnet outputs for {host.hostname} are up to date')
+            continue
+        tasks.extend(host_tasks)
+
+    if not tasks:
+        return ops
 
+    ops.append(
+        f'>> Preprocessing {len(tasks)} jsonnet entries with up to {PARALLEL_JOBS} jobs'
+    )
+    ops.extend(ensure_directories_exist_ops({t.output_directory() for t in tasks}))
     if verbose:
-        annotated_jsonnet_commands: list[RunOp] = [
-            f'DEBUG: {make_shell_command(cast(RunCmd, cmd))}'
-            for cmd in jsonnet_commands
-        ]
-        interleaved_dirs: list[RunOp] = []
-        for annotation, command in zip(annotated_jsonnet_commands, jsonnet_commands):
-            interleaved_dirs.append(annotation)
-            interleaved_dirs.append(command)
-        jsonnet_commands = interleaved_dirs
-
-    ops.extend(jsonnet_commands)
+        ops.extend(f'DEBUG: {make_shell_command(t.cli_command())}' for t in tasks)
+    ops.append(
+        JsonnetBatchOp(tasks, jobs=PARALLEL_JOBS, as_manifest=JSONNET_BATCH_FLAG)
+    )
     return ops
 
 
@@ -1130,26 +3449,26 @@ def make_finish_script(
     command_ops: Sequence[RunOp], script_path: Path, verbose: bool
 ) -> list[RunOp]:
     def write_script() -> None:
-        with open(script_path, 'w', encoding='utf-8') as f:
-            f.write('#!/bin/bash\n\n')
-            f.write('set -e\n\n')
-            if verbose:
-                f.write('set -x\n\n')
-            f.write(DECLARE_SCRIPT_DIR_LINE + '\n\n')
-            for op in command_ops:
-                if isinstance(op, str):
-                    line = (
-                        op[len(BASH_COMMAND_PREFIX) :]
-                        if op.startswith(BASH_COMMAND_PREFIX)
-                        else f'echo "{op}"'
-                    )
-                elif isinstance(op, list):
-                    line = make_shell_command(op)
-                else:
-                    raise TypeError(
-                        'Finish script operations must be strings or command lists'
-                    )
-                f.write(line + '\n')
+        lines = ['#!/bin/bash\n\n', 'set -e\n\n']
+        if verbose:
+            lines.append('set -x\n\n')
+        lines.append(DECLARE_SCRIPT_DIR_LINE + '\n\n')
+        for op in command_ops:
+            if isinstance(op, str):
+                line = (
+                    op[len(BASH_COMMAND_PREFIX) :]
+                    if op.startswith(BASH_COMMAND_PREFIX)
+                    else f'echo "{op}"'
+                )
+            elif isinstance(op, list):
+                line = make_shell_command(op)
+            else:
+                raise TypeError(
+                    'Finish script operations must be strings or command lists'
+                )
+            lines.append(line + '\n')
+        # Leave an unchanged script alone so incremental stages stay write-free.
+        write_text_if_changed(script_path, ''.join(lines))
 
     ops: list[RunOp] = [partial(write_script)]
     if verbose:
@@ -1159,6 +3478,59 @@ def make_finish_script(
     return ops
 
 
+def make_install_bash_commands(
+    host: Host, full_install_ops: Sequence[RunOp]
+) -> list[RunOp]:
+    """Wrap the full clean-and-copy install with a delta install.
+
+    finish.sh compares the staged manifest.tsv (sha256, mode, staged path and
+    target per line) with the copy recorded by the last successful install, and
+    only removes, adds or replaces what differs, plus any target that has gone
+    missing. `finish.sh --full`, or a host without a recorded install, runs
+    `full_install_ops` instead.
+    """
+    installed = f'$HOME/{host.config_dir}/{INSTALLED_MANIFEST_NAME}'
+    delta_block = dedent(f"""\
+        INSTALLED_MANIFEST="{installed}"
+        INCOMING_MANIFEST="$SCRIPT_DIR/{STAGING_INSTALL_LIST_NAME}"
+        if [ "${{1:-}}" != "--full" ] && [ -f "$INSTALLED_MANIFEST" ] && [ -f "$INCOMING_MANIFEST" ]; then
+        echo ">> Installing changed files for {host.hostname} (finish.sh --full reinstalls everything)"
+        MANIFEST_TMP="$(mktemp -d)"
+        LC_ALL=C sort "$INSTALLED_MANIFEST" > "$MANIFEST_TMP/installed"
+        LC_ALL=C sort "$INCOMING_MANIFEST" > "$MANIFEST_TMP/incoming"
+        cut -f4 "$MANIFEST_TMP/installed" | LC_ALL=C sort > "$MANIFEST_TMP/installed_targets"
+        cut -f4 "$MANIFEST_TMP/incoming" | LC_ALL=C sort > "$MANIFEST_TMP/incoming_targets"
+        LC_ALL=C comm -23 "$MANIFEST_TMP/installed_targets" "$MANIFEST_TMP/incoming_targets" | while IFS= read -r target; do
+            echo "Removing $HOME/$target"
+            rm -f "$HOME/$target"
+        done
+        LC_ALL=C comm -13 "$MANIFEST_TMP/installed" "$MANIFEST_TMP/incoming" > "$MANIFEST_TMP/changed"
+        while IFS=$'\\t' read -r digest mode path target; do
+            [ -e "$HOME/$target" ] || printf '%s\\t%s\\t%s\\t%s\\n' "$digest" "$mode" "$path" "$target"
+        done < "$MANIFEST_TMP/incoming" >> "$MANIFEST_TMP/changed"
+        LC_ALL=C sort -u "$MANIFEST_TMP/changed" | while IFS=$'\\t' read -r digest mode path target; do
+            echo "Installing $HOME/$target"
+            mkdir -p "$(dirname "$HOME/$target")"
+            cp -p "$SCRIPT_DIR/$path" "$HOME/$target"
+        done
+        rm -rf "$MANIFEST_TMP"
+        else
+        """)
+    record_block = dedent("""\
+        fi
+        if [ -f "$INCOMING_MANIFEST" ]; then
+            mkdir -p "$(dirname "$INSTALLED_MANIFEST")"
+            cp "$INCOMING_MANIFEST" "$INSTALLED_MANIFEST"
+        fi
+        """)
+
+    ops: list[RunOp] = []
+    ops.extend(BASH_COMMAND_PREFIX + line for line in delta_block.splitlines())
+    ops.extend(full_install_ops)
+    ops.extend(BASH_COMMAND_PREFIX + line for line in record_block.splitlines())
+    return ops
+
+
 def clean_remote_dotfiles(host: Host, treat_as_localhost: bool = False) -> list[RunOp]:
     ops: list[RunOp] = []
     ops.append(f'>> Cleaning existing configuration files for {host.hostname}')
@@ -1171,11 +3543,13 @@ def clean_remote_dotfiles(host: Host, treat_as_localhost: bool = False) -> list[
             {host.config_dir}.union(host.directory_maps.values())
         )
     ]
-    file_candidates = {f'{home}/{f}' for f in host.file_maps.values()}
+    removed_dirs = PathSet(dirs_to_remove)
     files_to_remove = [
         f
-        for f in remove_children_from_set(file_candidates.union(dirs_to_remove))
-        if f not in dirs_to_remove
+        for f in remove_children_from_set(
+            f'{home}/{f}' for f in host.file_maps.values()
+        )
+        if not removed_dirs.covers(f)
     ]
 
     ops.extend([['rm', '-rf', d] for d in dirs_to_remove])
@@ -1187,7 +3561,7 @@ def clean_remote_dotfiles(host: Host, treat_as_localhost: bool = False) -> list[
     return ops
 
 
-def push_remote_staging(host: Host) -> list[RunOp]:
+def push_remote_staging(host: Host, full_install: bool = False) -> list[RunOp]:
     ops: list[RunOp] = []
     ops.append(f'Syncing dotFiles for {host.hostname} from local staging directory')
     ops.append(
@@ -1210,70 +3584,443 @@ def push_remote_staging(host: Host) -> list[RunOp]:
         )
     else:
         ops.append(
-            [
-                'rsync',
+            host.rsync_command(
                 '-axv',
                 '--numeric-ids',
                 '--delete',
                 '--progress',
                 f'{(host.local_staging_dir).as_posix()}/',
                 f'{host.connection_host}:{host.remote_staging_dir}',
-            ]
+            )
         )
 
     remote_finish_path = f'{host.remote_staging_dir}/finish.sh'
     ops.append(
         f'>> Running finish script on {host.hostname}: /bin/bash {remote_finish_path}'
     )
-    ops.extend(host.make_ops([['/bin/bash', remote_finish_path]]))
+    ops.append(RemoteFinish(host, full_install))
 
     return ops
 
 
-def process_macros_for_staged_file(host: Host, file: Path) -> None:
-    try:
-        content = file.read_text(encoding='utf-8')
-    except UnicodeDecodeError:
-        # Directory maps can contain binary assets (including extensionless files
-        # such as .DS_Store), which cannot contain our line-oriented macros.
-        return
+def tree_size_bytes(root: Path) -> int:
+    """Total size of the files under `root` (symlinks counted as links)."""
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+@dataclass
+class RemoteFinish:
+    """Run a host's pushed finish.sh, which installs the staged tree into $HOME.
+
+    Under --timings its bytes moved is the staged tree's size: an upper bound,
+    since finish.sh skips files that are already installed.
+    """
+
+    host: Host
+    full_install: bool = False
+
+    def describe(self) -> list[RunOp]:
+        finish_command = ['/bin/bash', f'{self.host.remote_staging_dir}/finish.sh']
+        if self.full_install:
+            finish_command.append('--full')
+        return self.host.make_ops([finish_command])
+
+    @property
+    def bytes_moved(self) -> int:
+        return tree_size_bytes(self.host.local_staging_dir)
+
+    def __call__(self) -> None:
+        run_ops(self.describe())
+
+
+MACRO_TOKEN_PATTERN = re.compile(r'@@(FILE_NAME|NOW|PRAGMA_ARG)')
+
+
+@cache
+def macro_now() -> str:
+    """The @@NOW value, fixed for the whole run so every file agrees."""
+    return datetime.now().strftime('%Y-%m-%d %H:%M')
+
+
+class MacroEngine:
+    """A host's macros compiled once for repeated expansion.
+
+    Lines are matched against all macro keys with one anchored regex (keys
+    are tried in definition order, like the original `startswith` scan), and
+    templates are pre-split into literal text and @@ tokens. Files whose
+    bytes cannot contain any key are skipped without being decoded.
+    """
+
+    def __init__(self, macros: dict[str, list[str]]) -> None:
+        self.pattern = (
+            re.compile('|'.join(re.escape(key) for key in macros)) if macros else None
+        )
+        # Alternating literal / token-name segments (see re.split with a group).
+        self.templates = {
+            key: [MACRO_TOKEN_PATTERN.split(line) for line in lines]
+            for key, lines in macros.items()
+        }
+        # One bytes.find for the keys' shared prefix (b'#pragma ' in practice).
+        encoded = [key.encode('utf-8') for key in macros]
+        self.needles = [os.path.commonprefix(encoded)] if encoded else []
+        if self.needles == [b'']:
+            self.needles = encoded
+
+    def may_match(self, data: bytes) -> bool:
+        return any(data.find(needle) != -1 for needle in self.needles)
+
+    def inflate(self, key: str, file_name: str, pragma_arg: str) -> list[str]:
+        values = {'FILE_NAME': file_name, 'NOW': macro_now(), 'PRAGMA_ARG': pragma_arg}
+        return [
+            ''.join(
+                values[segment] if index % 2 else segment
+                for index, segment in enumerate(segments)
+            )
+            for segments in self.templates.get(key, [])
+        ]
 
-    is_modified = False
-    modified_content: list[str] = []
-    for line in content.splitlines():
-        # Expand macros (supports arguments after the keyword)
-        matched_macro = next((k for k in host.macros if line.startswith(k)), None)
-        if matched_macro is not None:
+    def expand(self, content: str, file_name: str) -> Optional[str]:
+        """Return `content` with macro lines expanded, or None if none matched."""
+        if self.pattern is None:
+            return None
+        match_line = self.pattern.match
+        is_modified = False
+        modified_content: list[str] = []
+        for line in content.splitlines():
+            # Expand macros (supports arguments after the keyword)
+            matched = match_line(line)
+            if matched is None:
+                modified_content.append(line)
+                continue
             is_modified = True
-            pragma_arg = line[len(matched_macro) :].strip()
+            pragma_arg = line[matched.end() :].strip()
             modified_content.extend(
-                host.get_inflated_macro(matched_macro, file, pragma_arg=pragma_arg)
+                self.inflate(matched.group(), file_name, pragma_arg)
             )
-        else:
-            modified_content.append(line)
-    if is_modified:
-        with open(file, 'w', encoding='utf-8') as f:
-            f.writelines(line + '\n' for line in modified_content)
+        if not is_modified:
+            return None
+        return ''.join(line + '\n' for line in modified_content)
+
+
+STAGING_MANIFEST_NAME = 'manifest.json'
+# Tab-separated sha256, mode, staged path and target, read by finish.sh.
+STAGING_INSTALL_LIST_NAME = 'manifest.tsv'
+# Copy of manifest.tsv from the last successful install, under config_dir.
+INSTALLED_MANIFEST_NAME = '.installed-manifest'
+# Files written into the staging dir by stage_local itself rather than staged.
+STAGING_GENERATED_FILES = frozenset(
+    {'finish.sh', STAGING_MANIFEST_NAME, STAGING_INSTALL_LIST_NAME}
+)
+MACRO_INELIGIBLE_SUFFIXES = frozenset(
+    {'.png', '.jpg', '.svg', '.jpeg', '.gif', '.webp'}
+)
+
+
+def hash_file_sha256(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def stat_fingerprint(stat: os.stat_result) -> list[int]:
+    # st_mode too: a chmod only touches ctime, and modes are staged and installed.
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode]
+
+
+@dataclass
+class IncrementalStage:
+    """Reconcile a host's staging tree with the files it should contain.
+
+    Each staged path is recorded in stage_state.json with its source, the
+    source's stat fingerprint and digest, and the staged file's fingerprint.
+    An entry is left untouched when its staged file is unchanged and its
+    source matches by fingerprint or, failing that, by digest. Other entries
+    are linked or copied again (and macro-expanded when eligible), and files
+    that are no longer part of the desired set are deleted.
+    """
+
+    host: Host
+    copy: BulkCopy
+    macro_paths: set[Path] = field(default_factory=set[Path])
+    force: bool = False
+    verbose: bool = False
+    bytes_moved: int = field(default=0, init=False)
+
+    def desired_entries(
+        self,
+    ) -> tuple[list[tuple[Path, Path]], dict[Path, tuple[Path, bool]]]:
+        """Return (directory pairs, staged path -> (source, linked))."""
+        return self.copy.expand()
+
+    def read_state(self) -> dict[str, dict[str, Any]]:
+        if self.force:
+            return {}
+        try:
+            with open(self.host.stage_state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        entries = data.get('entries') if isinstance(data, dict) else None
+        if not isinstance(entries, dict):
+            return {}
+        if data.get('macros') != self.macros_digest():
+            return {}
+        return cast(dict[str, dict[str, Any]], entries)
+
+    def macros_digest(self) -> str:
+        return hashlib.sha256(
+            json.dumps(self.host.macros, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def is_current(
+        self, src: Path, dest: Path, linked: bool, record: Optional[dict[str, Any]]
+    ) -> bool:
+        if record is None or record.get('source') != src.as_posix():
+            return False
+        if record.get('linked') != linked or record.get('macro') != (
+            dest in self.macro_paths
+        ):
+            return False
+        try:
+            source_stat = src.stat()
+            staged_stat = dest.lstat()
+        except OSError:
+            return False
+        if record.get('staged_stat') != stat_fingerprint(staged_stat):
+            return False
+        # Staged files carry their source's mode, even when the content matches.
+        if staged_stat.st_mode & 0o7777 != source_stat.st_mode & 0o7777:
+            return False
+        if not VERIFY_CACHE_FLAG and record.get('source_stat') == stat_fingerprint(
+            source_stat
+        ):
+            return True
+        return record.get('source_digest') == hash_file_sha256(src)
+
+    def stale_entries(
+        self, entries: dict[Path, tuple[Path, bool]]
+    ) -> tuple[dict[Path, tuple[Path, bool]], list[Path], dict[str, dict[str, Any]]]:
+        """Return (entries to restage, staged paths to delete, previous state)
+        for the desired `entries` from desired_entries()."""
+        previous = self.read_state()
+        staging_dir = self.host.local_staging_dir
+        stale = {
+            dest: (src, linked)
+            for dest, (src, linked) in entries.items()
+            if not self.is_current(
+                src,
+                dest,
+                linked,
+                previous.get(dest.relative_to(staging_dir).as_posix()),
+            )
+        }
+        extraneous: list[Path] = []
+        for dirpath, _, filenames in os.walk(staging_dir):
+            for name in filenames:
+                path = Path(dirpath, name)
+                if path in entries:
+                    continue
+                if (
+                    dirpath == staging_dir.as_posix()
+                    and name in STAGING_GENERATED_FILES
+                ):
+                    continue
+                extraneous.append(path)
+        return stale, sorted(extraneous), previous
+
+    def stage_with_macros(self, src: Path, dest: Path) -> bool:
+        """Write `src` to `dest` with its macros expanded, in one pass.
+
+        Returns False, leaving `dest` alone, when `src` has nothing to expand.
+        """
+        if src.is_symlink():
+            return False
+        data = src.read_bytes()
+        engine = self.host.macro_engine
+        if not engine.may_match(data):
+            return False
+        try:
+            content = data.decode('utf-8')
+        except UnicodeDecodeError:
+            # Binary assets cannot contain our line-oriented macros.
+            return False
+        expanded = engine.expand(content, dest.stem.upper())
+        if expanded is None:
+            return False
+        if self.verbose:
+            print(f'Processing macros in {dest}')
+        if dest.is_dir() and not dest.is_symlink():
+            shutil.rmtree(dest)
+        elif dest.is_symlink():
+            dest.unlink()
+        write_text_atomic(dest, expanded, mode=src.stat().st_mode & 0o7777)
+        return True
+
+    def describe(self) -> list[RunOp]:
+        _, entries = self.desired_entries()
+        stale, extraneous, _ = self.stale_entries(entries)
+        if not stale and not extraneous:
+            return [cast(RunOp, 'Staged files are up to date')]
+        ops: list[RunOp] = [['rm', '-f', path.as_posix()] for path in extraneous]
+        ops.extend(ensure_directories_exist_ops({dest.parent for dest in stale}))
+        for dest, (src, linked) in sorted(stale.items()):
+            ops.append(
+                ['ln' if linked else 'cp', '-f', src.as_posix(), dest.as_posix()]
+            )
+        return ops
+
+    def __call__(self) -> None:
+        staging_dir = self.host.local_staging_dir
+        directory_pairs, entries = self.desired_entries()
+        stale, extraneous, previous = self.stale_entries(entries)
+
+        for path in extraneous:
+            path.unlink()
+        # Drop directories left empty, unless they mirror a (possibly empty) source.
+        kept_directories = {dest for _, dest in directory_pairs}
+        for dirpath, _, _ in os.walk(staging_dir, topdown=False):
+            path = Path(dirpath)
+            if path != staging_dir and path not in kept_directories:
+                if not os.listdir(path):
+                    path.rmdir()
+
+        BulkCopy.make_directories(
+            chain(
+                (dest for _, dest in directory_pairs),
+                (dest.parent for dest in stale),
+            )
+        )
+        # Macro-bearing files are expanded straight from their source; every
+        # other entry (including eligible files without macros) is copied.
+        plain_entries: dict[Path, tuple[Path, bool]] = {}
+        with timed_span(self.host.hostname, 'macros', 'macro expansion'):
+            for dest, (src, linked) in sorted(stale.items()):
+                if dest not in self.macro_paths or not self.stage_with_macros(
+                    src, dest
+                ):
+                    plain_entries[dest] = (src, linked)
+        BulkCopy.copy_entries(plain_entries)
+        self.bytes_moved = sum(dest.lstat().st_size for dest in stale)
+        BulkCopy.restore_directory_stats(directory_pairs)
+
+        if self.verbose:
+            print(
+                f'Staged {len(stale)} changed and removed {len(extraneous)} stale of '
+                f'{len(entries)} files for {self.host.hostname}'
+            )
+
+        racy_cutoff = time.time_ns() - RACY_FINGERPRINT_WINDOW_NS
+        state: dict[str, dict[str, Any]] = {}
+        manifest: list[dict[str, Any]] = []
+        for dest, (src, linked) in sorted(entries.items()):
+            key = dest.relative_to(staging_dir).as_posix()
+            record = previous.get(key)
+            source_stat, staged_stat = src.stat(), dest.lstat()
+            if dest in stale or record is None:
+                record = {
+                    'source': src.as_posix(),
+                    'linked': linked,
+                    'macro': dest in self.macro_paths,
+                    'source_digest': hash_file_sha256(src),
+                }
+            else:
+                record = dict(record)
+            if dest in stale or not record.get('staged_digest'):
+                # Only macro-eligible files can differ from their source.
+                record['staged_digest'] = (
+                    hash_file_sha256(dest)
+                    if dest in self.macro_paths
+                    else record['source_digest']
+                )
+            # A racily-recent source might change again within the same mtime tick.
+            record['source_stat'] = (
+                stat_fingerprint(source_stat)
+                if source_stat.st_mtime_ns < racy_cutoff
+                else None
+            )
+            record['staged_stat'] = stat_fingerprint(staged_stat)
+            state[key] = record
+
+            target, origin = self.host.describe_staged_path(key)
+            if record['staged_digest'] != record['source_digest']:
+                origin = 'macro-expanded'
+            manifest.append(
+                {
+                    'path': key,
+                    'target': target,
+                    'size': staged_stat.st_size,
+                    'mode': f'{staged_stat.st_mode & 0o7777:04o}',
+                    'sha256': record['staged_digest'],
+                    'origin': origin,
+                }
+            )
+        write_text_if_changed(
+            self.host.stage_state_path,
+            json.dumps(
+                {'macros': self.macros_digest(), 'entries': state},
+                indent=4,
+                sort_keys=True,
+            ),
+        )
+        write_text_if_changed(
+            staging_dir / STAGING_MANIFEST_NAME,
+            json.dumps(
+                {'host': self.host.hostname, 'files': manifest},
+                indent=4,
+                sort_keys=True,
+            ),
+        )
+        write_text_if_changed(
+            staging_dir / STAGING_INSTALL_LIST_NAME,
+            ''.join(
+                f'{f["sha256"]}\t{f["mode"]}\t{f["path"]}\t{f["target"]}\n'
+                for f in manifest
+            ),
+        )
 
 
 def stage_local(
-    host: Host, verbose: bool = False, skip_cache: bool = False
+    host: Host,
+    verbose: bool = False,
+    skip_cache: bool = False,
+    include_jsonnet: bool = True,
 ) -> list[RunOp]:
+    return list(
+        chain.from_iterable(
+            node.ops
+            for node in stage_local_nodes(
+                host,
+                verbose=verbose,
+                skip_cache=skip_cache,
+                include_jsonnet=include_jsonnet,
+            )
+        )
+    )
+
+
+def stage_local_nodes(
+    host: Host,
+    verbose: bool = False,
+    skip_cache: bool = False,
+    include_jsonnet: bool = True,
+) -> list[OpNode]:
+    """Stage `host` as curl, jsonnet, staging and finish-script graph nodes."""
     ops: list[RunOp] = []
     ops.append(
         f'Staging dotFiles for {host.hostname} in {host.local_staging_dir.as_posix()}'
     )
-    ops.extend(
-        ensure_directories_exist_ops({host.local_staging_dir}, already_exists_ok=False)
-    )
 
     # Decide if preprocessing is necessary based on host cache validity
-    if skip_cache:
-        needs_jsonnet_preprocess = True
-        needs_curl_preprocess = True
-    else:
-        needs_jsonnet_preprocess = not host.jsonnet_cache_valid
-        needs_curl_preprocess = not host.curl_cache_valid
+    needs_curl_preprocess = skip_cache or not host.curl_cache_valid
 
     # No need to preserve cache subdirs; they live outside staged output now.
 
@@ -1301,121 +4048,95 @@ def stage_local(
         ops.append('>> Using repository Ghostty terminfo fallback for embedding')
 
     if needs_curl_preprocess:
+        # --skip-cache revalidates every URL; otherwise only missing or expired ones.
+        stale_sources = None if skip_cache else host.stale_curl_sources()
         ops.append('>> Preprocessing curl files')
-        ops.extend(preprocess_curl_files(host, verbose=verbose))
-    else:
-        ops.append('>> Skipping curl preprocessing (using preserved cache)')
-
-    if needs_jsonnet_preprocess:
-        ops.append('>> Preprocessing jsonnet files')
         ops.extend(
-            preprocess_jsonnet_files(host, CWD, host.local_jsonnet_dir, verbose=verbose)
-        )
-        ops.extend(
-            preprocess_jsonnet_directories(
-                host, CWD, host.local_jsonnet_dir, verbose=verbose
+            preprocess_curl_files(
+                host, verbose=verbose, sources=stale_sources, revalidate=skip_cache
             )
         )
     else:
-        ops.append('>> Skipping jsonnet preprocessing (no source changes)')
-
-    # Persist updated cache hashes (after any preprocessing decisions)
-    ops.append(host.update_cache_hashes)
-
-    # Stage prestaged outputs from caches into staging dir
-    # - Copy jsonnet directories
-    if host.jsonnet_multi_maps:
-        ops.extend(
-            copy_directories_local(
-                host.local_jsonnet_dir,
-                host.jsonnet_multi_maps.values(),
-                host.local_staging_dir,
-                host.jsonnet_multi_maps.values(),
+        ops.append('>> Skipping curl preprocessing (using preserved cache)')
+    nodes = [OpNode(f'{host.hostname}: curl', ops, outputs=[host.local_curl_dir])]
+
+    # Jsonnet for several hosts may already have been scheduled as one batch.
+    if include_jsonnet:
+        nodes.append(
+            OpNode(
+                f'{host.hostname}: jsonnet',
+                preprocess_jsonnet([host], verbose=verbose, skip_cache=skip_cache),
+                outputs=[host.local_jsonnet_dir],
             )
         )
-    # - Copy jsonnet single-file outputs
-    if host.jsonnet_maps:
-        src_files = [
-            (host.local_jsonnet_dir / d).as_posix() for d in host.jsonnet_maps.values()
-        ]
-        dst_paths = [(host.local_staging_dir / d) for d in host.jsonnet_maps.values()]
-        dst_files = [p.as_posix() for p in dst_paths]
-        ops.extend(ensure_directories_exist_ops({p.parent for p in dst_paths}))
-        ops.extend([['cp', s, d] for s, d in zip(src_files, dst_files)])
-    # - Copy curl downloads
-    if host.curl_maps:
-        curl_src_files = [
-            (host.local_curl_dir / d).as_posix() for d in host.curl_maps.values()
-        ]
-        curl_dst_paths = [(host.local_staging_dir / d) for d in host.curl_maps.values()]
-        curl_dst_files = [p.as_posix() for p in curl_dst_paths]
-        ops.extend(ensure_directories_exist_ops({p.parent for p in curl_dst_paths}))
-        ops.extend([['cp', s, d] for s, d in zip(curl_src_files, curl_dst_files)])
+
+    # Persist updated cache hashes (after any preprocessing decisions)
+    ops = [host.update_cache_hashes]
+
+    # Stage prestaged outputs from caches and repository sources in one pass.
+    # Jsonnet and curl outputs are immutable cache artifacts, so they are linked
+    # rather than copied; the macro pass replaces any file it rewrites.
+    bulk_copy = BulkCopy()
+    bulk_copy.linked_directories.extend(
+        (host.local_jsonnet_dir / d, host.local_staging_dir / d)
+        for d in host.jsonnet_multi_maps.values()
+    )
+    bulk_copy.linked_files.extend(
+        (host.local_jsonnet_dir / d, host.local_staging_dir / d)
+        for d in host.jsonnet_maps.values()
+    )
+    bulk_copy.linked_files.extend(
+        (host.local_curl_dir / d, host.local_staging_dir / d)
+        for d in host.curl_maps.values()
+    )
 
     ops.append('>> Staging directories and files')
     if verbose:
         ops.append(f'Directories to stage: {directories_to_stage}')
         ops.append(f'Files to stage: {files_to_stage}')
-    ops.extend(
-        copy_directories_local(
-            CWD, directories_to_stage, host.local_staging_dir, directories_to_stage
-        )
+    bulk_copy.directories.extend(
+        (CWD / d, host.local_staging_dir / d) for d in directories_to_stage
     )
-    ops.extend(
-        copy_files_local(CWD, files_to_stage, host.local_staging_dir, files_to_stage)
+    bulk_copy.files.extend(
+        (CWD / f, host.local_staging_dir / f) for f in files_to_stage
     )
 
+    # Macro eligibility is decided here, but applied only to files that exist
+    # once staged and that the incremental stage actually rewrites.
+    macro_paths: set[Path] = set()
     if host.macros:
-        tracked_files = git_tracked_files(CWD)
-
-        def is_path_eligible_for_macros(path: Path) -> bool:
-            if not path.is_file():
-                return False
-            return path.suffix.lower() not in {
-                '.png',
-                '.jpg',
-                '.svg',
-                '.jpeg',
-                '.gif',
-                '.webp',
-            }
-
-        files_to_process: set[Path] = set()
-
-        for file in files_to_stage:
-            if Path(file) not in tracked_files:
-                continue
-            candidate = host.local_staging_dir / file
-            if is_path_eligible_for_macros(candidate):
-                files_to_process.add(candidate)
-
+        tracked_files = git_tracked_index(CWD)
+        candidates = [Path(file) for file in files_to_stage]
+        candidates = [file for file in candidates if file in tracked_files]
         for directory in directories_to_stage:
-            directory_path = Path(directory)
-            for tracked_file in tracked_files:
-                if not tracked_file.is_relative_to(directory_path):
-                    continue
-                candidate = host.local_staging_dir / tracked_file
-                if is_path_eligible_for_macros(candidate):
-                    files_to_process.add(candidate)
-
+            candidates.extend(Path(p) for p in tracked_files.under(directory))
         # Include any pre-staged files generated from jsonnet outputs.
-        for file in host.prestaged_files:
-            candidate = host.local_staging_dir / file
-            if is_path_eligible_for_macros(candidate):
-                files_to_process.add(candidate)
-
-        if files_to_process:
-            ops.append('>> Preprocessing macros in local staged files')
-            for f in sorted(files_to_process):
-                if verbose:
-                    ops.append(f'Processing macros in {f}')
-                ops.append(partial(process_macros_for_staged_file, host=host, file=f))
+        candidates.extend(Path(file) for file in host.prestaged_files)
+        macro_paths = {
+            host.local_staging_dir / candidate
+            for candidate in candidates
+            if candidate.suffix.lower() not in MACRO_INELIGIBLE_SUFFIXES
+        }
 
-    finish_ops: list[RunOp] = []
+    ops.append(
+        IncrementalStage(
+            host, bulk_copy, macro_paths, force=skip_cache, verbose=verbose
+        )
+    )
+    nodes.append(
+        OpNode(
+            f'{host.hostname}: stage',
+            ops,
+            inputs=[host.local_curl_dir, host.local_jsonnet_dir],
+            outputs=[host.local_staging_dir, host.cache_json_path],
+        )
+    )
 
-    finish_ops.extend(clean_remote_dotfiles(host, treat_as_localhost=True))
+    full_install_ops: list[RunOp] = []
 
-    finish_ops.extend(
+    full_install_ops.extend(clean_remote_dotfiles(host, treat_as_localhost=True))
+
+    full_install_ops.extend(
         copy_directories_local(
             SCRIPTDIR_VAR_PATH,
             host.directory_maps.keys(),
@@ -1423,7 +4144,7 @@ def stage_local(
             host.directory_maps.values(),
         )
     )
-    finish_ops.extend(
+    full_install_ops.extend(
         copy_files_local(
             SCRIPTDIR_VAR_PATH,
             host.file_maps.keys(),
@@ -1432,6 +4153,9 @@ def stage_local(
         )
     )
 
+    finish_ops: list[RunOp] = []
+    finish_ops.extend(make_install_bash_commands(host, full_install_ops))
+
     finish_ops.append('>> Installing Ghostty terminfo entry')
     finish_ops.append(
         BASH_COMMAND_PREFIX
@@ -1461,9 +4185,60 @@ def stage_local(
     )
 
     finish_script = host.local_staging_dir / 'finish.sh'
-    ops.extend(make_finish_script(finish_ops, finish_script, verbose=verbose))
-
-    return ops
+    nodes.append(
+        OpNode(
+            f'{host.hostname}: finish script',
+            make_finish_script(finish_ops, finish_script, verbose=verbose),
+            outputs=[finish_script],
+        )
+    )
+    return nodes
+
+
+def stage_hosts_graph(
+    hosts: Sequence[Host],
+    verbose: bool = False,
+    skip_cache: bool = False,
+    push: bool = False,
+    full_install: bool = False,
+    quiet: bool = False,
+) -> OpGraph:
+    """Stage (and optionally push) `hosts` as one graph of independent nodes.
+
+    Jsonnet for all hosts is one batch; curl downloads, staging and finish
+    scripts of different hosts run concurrently. Pushes stay one host at a
+    time, in order, since they share the terminal with ssh.
+    """
+    nodes = [
+        OpNode(
+            'jsonnet',
+            preprocess_jsonnet(hosts, verbose=verbose, skip_cache=skip_cache),
+            outputs=[host.local_jsonnet_dir for host in hosts],
+        )
+    ]
+    for host in hosts:
+        nodes.extend(
+            stage_local_nodes(
+                host, verbose=verbose, skip_cache=skip_cache, include_jsonnet=False
+            )
+        )
+    if push:
+        previous: list[str] = []
+        for host in hosts:
+            if host.stage_only:
+                continue
+            nodes.append(
+                OpNode(
+                    f'{host.hostname}: push',
+                    push_remote_staging(host, full_install=full_install),
+                    inputs=[host.local_staging_dir],
+                    deps=previous,
+                )
+            )
+            previous = [nodes[-1].name]
+        if any(host.is_localhost and host.kernel == 'darwin' for host in hosts):
+            nodes.append(OpNode('iterm2 prefs', [push_iterm2_prefs], deps=previous))
+    return OpGraph(nodes, jobs=PARALLEL_JOBS, quiet=quiet)
 
 
 def pull_remote(host: Host) -> list[RunOp]:
@@ -1507,11 +4282,10 @@ def pull_remote(host: Host) -> list[RunOp]:
         ops.append(['cp', unfinish_script_path.as_posix(), host.remote_staging_dir])
     else:
         ops.append(
-            [
-                'scp',
+            host.scp_command(
                 unfinish_script_path.as_posix(),
                 f'{host.connection_host}:{host.remote_staging_dir}',
-            ]
+            )
         )
 
     ops.extend(host.make_ops([['/bin/bash', f'{host.remote_staging_dir}/unfinish.sh']]))
@@ -1522,15 +4296,14 @@ def pull_remote(host: Host) -> list[RunOp]:
         )
     else:
         ops.append(
-            [
-                'rsync',
+            host.rsync_command(
                 '-axv',
                 '--numeric-ids',
                 '--delete',
                 '--progress',
                 f'{host.connection_host}:{host.remote_staging_dir}/',
                 snapshot_dir.as_posix(),
-            ]
+            )
         )
 
     return ops
@@ -1746,7 +4519,53 @@ def main(args: list[str]) -> int:
     parser.add_argument(
         '--skip-cache',
         action='store_true',
-        help='Skip caches and rebuild curl/jsonnet artifacts',
+        help='Skip caches and rebuild curl/jsonnet artifacts and the evaluated config',
+    )
+    parser.add_argument(
+        '--verify-cache',
+        action='store_true',
+        help='Rehash all cached inputs instead of trusting recorded file fingerprints',
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        help='Maximum parallel jobs and downloads (default: CPU count, 8 downloads)',
+    )
+    parser.add_argument(
+        '--jsonnet-batch',
+        action='store_true',
+        help='Evaluate Jsonnet for all hosts as one program so shared imports are parsed once',
+    )
+    parser.add_argument(
+        '--curl-ttl',
+        type=float,
+        metavar='HOURS',
+        help='Revalidate cached curl downloads older than this (default: 24)',
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Clean and reinstall every file on push instead of only changed ones',
+    )
+    parser.add_argument(
+        '--parallel',
+        type=int,
+        metavar='N',
+        help='Run each host in its own pipeline, up to N hosts at a time',
+    )
+    parser.add_argument(
+        '--host-timeout',
+        type=float,
+        metavar='SECONDS',
+        help='With --parallel, stop a host pipeline that runs longer than this',
+    )
+    parser.add_argument(
+        '--timings',
+        nargs='?',
+        const='',
+        metavar='PATH',
+        help='Print the slowest ops and time per host/phase; with PATH, also write a Chrome trace JSON (covering every --parallel host pipeline)',
     )
     parser.add_argument('--working-dir', help='Set the working directory')
     parser.add_argument(
@@ -1764,14 +4583,25 @@ def main(args: list[str]) -> int:
     if parsed_args.working_dir:
         os.chdir(parsed_args.working_dir)
 
-    global CWD, OS_CWD, OUT_DIR_ROOT, TRACE_STARTUP_FLAG, config
+    global CWD, OS_CWD, OUT_DIR_ROOT, TRACE_STARTUP_FLAG, VERIFY_CACHE_FLAG
+    global PARALLEL_JOBS, JSONNET_BATCH_FLAG, CURL_CACHE_TTL_SECONDS, config
+    global CURL_DOWNLOAD_JOBS, OP_TIMINGS
     CWD = Path.cwd()
     OS_CWD = mingify_path(os.getcwd())
     OUT_DIR_ROOT = CWD / 'out'
     TRACE_STARTUP_FLAG = bool(getattr(parsed_args, 'trace_startup', False))
+    VERIFY_CACHE_FLAG = bool(getattr(parsed_args, 'verify_cache', False))
+    JSONNET_BATCH_FLAG = bool(getattr(parsed_args, 'jsonnet_batch', False))
+    if parsed_args.jobs is not None:
+        if parsed_args.jobs < 1:
+            raise ValueError('--jobs must be at least 1')
+        PARALLEL_JOBS = parsed_args.jobs
+        CURL_DOWNLOAD_JOBS = parsed_args.jobs
+    if parsed_args.curl_ttl is not None:
+        CURL_CACHE_TTL_SECONDS = int(parsed_args.curl_ttl * 60 * 60)
 
     os.makedirs(OUT_DIR_ROOT, exist_ok=True)
-    config = Config.load()
+    config = Config.load(skip_cache=bool(getattr(parsed_args, 'skip_cache', False)))
 
     operation_arg = parsed_args.operation
     if operation_arg.endswith('-local'):
@@ -1830,12 +4660,69 @@ def main(args: list[str]) -> int:
     if effective_operation in host_operations and not hosts:
         raise ValueError('No hosts specified')
 
+    if parsed_args.parallel is not None and parsed_args.parallel < 1:
+        raise ValueError('--parallel must be at least 1')
+    if parsed_args.host_timeout is not None and parsed_args.parallel is None:
+        raise ValueError('--host-timeout requires --parallel')
+
     ops: list[RunOp] = []
 
     skip_cache = bool(getattr(parsed_args, 'skip_cache', False))
     verbose_flag = bool(getattr(parsed_args, 'verbose', False))
+    full_install = bool(getattr(parsed_args, 'full', False))
+
+    pipelines: Optional[HostPipelines] = None
+    if (
+        parsed_args.parallel is not None
+        and effective_operation in {'clean', 'push', 'push-only', 'stage'}
+        and len(hosts) > 1
+    ):
+        forwarded_args = [
+            flag
+            for flag, enabled in (
+                ('--skip-cache', skip_cache),
+                ('--verify-cache', VERIFY_CACHE_FLAG),
+                ('--jsonnet-batch', JSONNET_BATCH_FLAG),
+                ('--full', full_install),
+                ('--verbose', verbose_flag),
+                ('--quiet', parsed_args.quiet),
+                ('--trace-startup', TRACE_STARTUP_FLAG),
+            )
+            if enabled
+        ]
+        if parsed_args.jobs is not None:
+            forwarded_args.extend(['--jobs', str(parsed_args.jobs)])
+        if parsed_args.curl_ttl is not None:
+            forwarded_args.extend(['--curl-ttl', str(parsed_args.curl_ttl)])
+        pipeline_hosts = [
+            host
+            for host in hosts
+            if effective_operation in {'push', 'stage'} or not host.stage_only
+        ]
+        pipeline_commands = host_pipeline_commands(
+            effective_operation, pipeline_hosts, forwarded_args
+        )
+        if parsed_args.timings is not None:
+            # Each host prints its own summary and, given a PATH, writes its own
+            # trace next to it; those are merged into PATH once all finish.
+            for hostname, command in pipeline_commands.items():
+                command.append('--timings')
+                if parsed_args.timings:
+                    trace_path = Path(parsed_args.timings).resolve()
+                    command.append(host_trace_path(trace_path, hostname).as_posix())
+        pipelines = HostPipelines(
+            pipeline_commands,
+            jobs=parsed_args.parallel,
+            timeout=parsed_args.host_timeout,
+        )
 
     match effective_operation:
+        case 'clean' | 'push' | 'push-only' | 'stage' if pipelines is not None:
+            ops.append(pipelines)
+            if effective_operation == 'push' and any(
+                host.is_localhost and host.kernel == 'darwin' for host in hosts
+            ):
+                ops.append(push_iterm2_prefs)
         case 'bootstrap-windows':
             ops.extend(bootstrap_windows())
         case 'clean':
@@ -1862,19 +4749,16 @@ def main(args: list[str]) -> int:
                 raise ValueError('Cannot pull from multiple hosts')
             ops.extend(pull_remote(hosts[0]))
         case 'push':
-            ops.extend(
-                chain.from_iterable(
-                    stage_local(host, verbose=verbose_flag, skip_cache=skip_cache)
-                    for host in hosts
-                )
-            )
-            ops.extend(
-                chain.from_iterable(
-                    push_remote_staging(host) for host in hosts if not host.stage_only
+            ops.append(
+                stage_hosts_graph(
+                    hosts,
+                    verbose=verbose_flag,
+                    skip_cache=skip_cache,
+                    push=True,
+                    full_install=full_install,
+                    quiet=parsed_args.quiet,
                 )
             )
-            if any(host.is_localhost and host.kernel == 'darwin' for host in hosts):
-                ops.append(push_iterm2_prefs)
         case 'push-gnome-settings':
             ops.extend(push_gnome_settings())
         case 'push-iterm2-prefs':
@@ -1882,16 +4766,20 @@ def main(args: list[str]) -> int:
         case 'push-only':
             ops.extend(
                 chain.from_iterable(
-                    push_remote_staging(host) for host in hosts if not host.stage_only
+                    push_remote_staging(host, full_install=full_install)
+                    for host in hosts
+                    if not host.stage_only
                 )
             )
         case 'snapshot-iterm2-prefs':
             ops.append(snapshot_iterm2_prefs_json)
         case 'stage':
-            ops.extend(
-                chain.from_iterable(
-                    stage_local(host, verbose=verbose_flag, skip_cache=skip_cache)
-                    for host in hosts
+            ops.append(
+                stage_hosts_graph(
+                    hosts,
+                    verbose=verbose_flag,
+                    skip_cache=skip_cache,
+                    quiet=parsed_args.quiet,
                 )
             )
         case 'update-workspace-settings':
@@ -1904,8 +4792,32 @@ def main(args: list[str]) -> int:
 
     if parsed_args.dry_run:
         print_ops(ops, quiet=parsed_args.quiet)
-    else:
+        return 0
+
+    if any(not host.is_localhost for host in hosts) and ssh_multiplexing_supported():
+        ssh_control_dir().mkdir(parents=True, exist_ok=True)
+    if parsed_args.timings is not None:
+        OP_TIMINGS = OpTimings()
+    try:
         run_ops(ops, quiet=parsed_args.quiet)
+    finally:
+        for host in hosts:
+            host.close_ssh_control_master()
+        if OP_TIMINGS is not None:
+            for line in OP_TIMINGS.summary():
+                print(line)
+            if parsed_args.timings:
+                trace_path = Path(parsed_args.timings).resolve()
+                trace = OP_TIMINGS.chrome_trace(
+                    f'apply.py {operation_arg} ({", ".join(h.hostname for h in hosts)})'
+                )
+                if pipelines is not None:
+                    merge_chrome_traces(
+                        trace,
+                        (host_trace_path(trace_path, h) for h in pipelines.commands),
+                    )
+                trace_path.write_text(json.dumps(trace, indent=1), encoding='utf-8')
+                print(f'Wrote Chrome trace to {trace_path}')
     return 0
 
 
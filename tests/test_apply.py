@@ -0,0 +1,1522 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import apply
+
+
+class JsonnetImportGraphTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        apply._jsonnet_source_deps.clear()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+        apply._jsonnet_source_deps.clear()
+
+    def write(self, relative_path: str, content: str) -> Path:
+        path = self.test_root / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding='utf-8')
+        return path
+
+    def test_closure_follows_transitive_imports_and_ext_vars(self) -> None:
+        self.write('core.libsonnet', "{ host: std.extVar('hostname') }")
+        self.write('colors.libsonnet', '{ red: 1 }')
+        self.write('banner.txt', 'hello')
+        self.write(
+            'lib/shared.libsonnet',
+            "local core = import '../core.libsonnet';\n"
+            'local colors = import "../colors.libsonnet";\n'
+            'core + colors',
+        )
+        entry = self.write(
+            'app/entry.jsonnet',
+            "// import 'missing.libsonnet' is ignored\n"
+            "local shared = import '../lib/shared.libsonnet';\n"
+            "shared + { banner: importstr '../banner.txt' }",
+        )
+
+        inputs, ext_var_keys = apply.jsonnet_import_closure(entry)
+
+        self.assertEqual(
+            [p.relative_to(self.test_root).as_posix() for p in inputs],
+            [
+                'app/entry.jsonnet',
+                'banner.txt',
+                'colors.libsonnet',
+                'core.libsonnet',
+                'lib/shared.libsonnet',
+            ],
+        )
+        self.assertEqual(ext_var_keys, ['hostname'])
+
+    def test_scan_skips_comments_and_strings_and_flags_computed_keys(self) -> None:
+        self.write('real.libsonnet', '{}')
+        self.write('quoted.libsonnet', '{}')
+        entry = self.write(
+            'entry.jsonnet',
+            "/* import 'quoted.libsonnet' */\n"
+            "# std.extVar('commented')\n"
+            "local real = import 'real.libsonnet';\n"
+            "{ text: \"import 'quoted.libsonnet' std.extVar('quoted')\","
+            " kernel: std.extVar('kernel') }",
+        )
+        dynamic = self.write(
+            'dynamic.jsonnet', "local key = 'host' + 'name'; std.extVar(key)"
+        )
+
+        inputs, keys = apply.jsonnet_import_closure(entry)
+        self.assertEqual(
+            [p.relative_to(self.test_root).as_posix() for p in inputs],
+            ['entry.jsonnet', 'real.libsonnet'],
+        )
+        self.assertEqual(keys, ['kernel'])
+
+        inputs, keys = apply.jsonnet_import_closure(dynamic)
+        self.assertEqual(keys, [apply.JSONNET_ANY_EXT_VAR])
+
+        def digest(ext_vars: dict[str, str]) -> str:
+            return apply.compute_jsonnet_entry_digest(
+                'dynamic.jsonnet', 'dynamic.json', False, inputs, keys, ext_vars
+            )
+
+        self.assertNotEqual(digest({'hostname': 'a'}), digest({'hostname': 'b'}))
+
+    def test_source_walk_prunes_tool_dirs_and_is_shared_by_hosts(self) -> None:
+        for relative_path in (
+            'a.jsonnet',
+            'lib/b.libsonnet',
+            'lib/notes.txt',
+            'web/c.jsonnet',
+            'web/node_modules/pkg/d.jsonnet',
+            'out/generated.jsonnet',
+            '.git/e.jsonnet',
+            '.venv/f.libsonnet',
+        ):
+            self.write(relative_path, '{}')
+        self.addCleanup(setattr, apply, 'CWD', apply.CWD)
+        self.addCleanup(setattr, apply, 'OUT_DIR_ROOT', apply.OUT_DIR_ROOT)
+        apply.CWD = self.test_root
+        apply.OUT_DIR_ROOT = self.test_root / 'out'
+        apply._jsonnet_source_files.clear()
+        self.addCleanup(apply._jsonnet_source_files.clear)
+        hosts = [
+            apply.Host(name, '.config/dotShell', '/home/someone')
+            for name in ('alpha', 'beta')
+        ]
+
+        with mock.patch.object(os, 'scandir', wraps=os.scandir) as scandir:
+            for host in hosts:
+                host.compute_jsonnet_inputs_hash()
+
+        self.assertEqual(
+            [
+                p.relative_to(self.test_root).as_posix()
+                for p in apply.jsonnet_source_files(self.test_root)
+            ],
+            ['a.jsonnet', 'lib/b.libsonnet', 'web/c.jsonnet'],
+        )
+        self.assertEqual(
+            sorted(Path(call.args[0]).name for call in scandir.call_args_list),
+            sorted([self.test_root.name, 'lib', 'web']),
+        )
+
+    def test_entry_digest_tracks_only_read_ext_vars(self) -> None:
+        entry = self.write('entry.jsonnet', "{ k: std.extVar('kernel') }")
+        inputs, keys = apply.jsonnet_import_closure(entry)
+
+        def digest(ext_vars: dict[str, str]) -> str:
+            return apply.compute_jsonnet_entry_digest(
+                'entry.jsonnet', 'entry.json', False, inputs, keys, ext_vars
+            )
+
+        base = digest({'kernel': 'linux', 'hostname': 'a'})
+        self.assertEqual(base, digest({'kernel': 'linux', 'hostname': 'b'}))
+        self.assertNotEqual(base, digest({'kernel': 'darwin', 'hostname': 'a'}))
+
+        entry.write_text("{ k: std.extVar('kernel'), x: 1 }", encoding='utf-8')
+        self.assertNotEqual(base, digest({'kernel': 'linux', 'hostname': 'a'}))
+
+
+class SourceFingerprintTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        apply._source_fingerprints.clear()
+        apply._verified_sources.clear()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+        apply._source_fingerprints.clear()
+        apply._verified_sources.clear()
+        apply.VERIFY_CACHE_FLAG = False
+
+    def test_unchanged_stat_reuses_recorded_digest(self) -> None:
+        path = self.test_root / 'a.jsonnet'
+        path.write_text('{ a: 1 }', encoding='utf-8')
+        original = apply.file_content_digest(path)
+
+        # Same size and restored mtime/inode: the recorded digest is trusted.
+        stat = path.stat()
+        with open(path, 'r+', encoding='utf-8') as f:
+            f.write('{ a: 2 }')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(apply.file_content_digest(path), original)
+
+        apply.VERIFY_CACHE_FLAG = True
+        apply._verified_sources.clear()
+        self.assertNotEqual(apply.file_content_digest(path), original)
+
+
+class JsonnetBatchManifestTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        backend = apply.get_jsonnet_backend()
+        if not isinstance(backend, apply.BindingJsonnetBackend):
+            raise unittest.SkipTest('the _jsonnet binding is not installed')
+        self.backend = backend
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        apply._jsonnet_source_deps.clear()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+        apply._jsonnet_source_deps.clear()
+
+    def test_batch_matches_per_entry_evaluation(self) -> None:
+        root = self.test_root
+        (root / 'lib').mkdir()
+        (root / 'lib' / 'core.libsonnet').write_text(
+            "{ host: std.extVar('hostname'), empty: [] }", encoding='utf-8'
+        )
+        (root / 'lib' / 'shared.libsonnet').write_text(
+            '{ greeting: "hi" }', encoding='utf-8'
+        )
+        (root / 'host.jsonnet').write_text(
+            "local core = import 'lib/core.libsonnet';\n"
+            "local shared = import 'lib/shared.libsonnet';\n"
+            'core + shared',
+            encoding='utf-8',
+        )
+        (root / 'banner.jsonnet').write_text(
+            "(import 'lib/shared.libsonnet').greeting", encoding='utf-8'
+        )
+
+        def tasks(out_dir: Path) -> list[apply.JsonnetTask]:
+            result: list[apply.JsonnetTask] = []
+            for hostname in ('alpha', 'beta'):
+                host_dir = out_dir / hostname
+                host_dir.mkdir(parents=True)
+                ext_vars = {'hostname': hostname}
+                result.append(
+                    apply.JsonnetTask(
+                        hostname,
+                        'host.jsonnet',
+                        root / 'host.jsonnet',
+                        ext_vars,
+                        host_dir / 'host.json',
+                    )
+                )
+                result.append(
+                    apply.JsonnetTask(
+                        hostname,
+                        'banner.jsonnet',
+                        root / 'banner.jsonnet',
+                        ext_vars,
+                        host_dir / 'banner.sh',
+                    )
+                )
+            return result
+
+        for task in tasks(root / 'single'):
+            self.backend.render_to_path(
+                task.jsonnet_file, task.ext_vars, task.output_path
+            )
+        self.backend.render_manifest(tasks(root / 'batch'))
+
+        for hostname in ('alpha', 'beta'):
+            for name in ('host.json', 'banner.sh'):
+                self.assertEqual(
+                    (root / 'batch' / hostname / name).read_text(encoding='utf-8'),
+                    (root / 'single' / hostname / name).read_text(encoding='utf-8'),
+                )
+        self.assertIn(
+            '"host": "beta"',
+            (root / 'batch' / 'beta' / 'host.json').read_text(encoding='utf-8'),
+        )
+
+    def test_batch_leaves_strings_alone_and_evaluates_computed_keys_per_host(
+        self,
+    ) -> None:
+        root = self.test_root
+        (root / 'quoted.jsonnet').write_text(
+            "// std.extVar('hostname') in a comment\n"
+            "{ host: std.extVar('hostname'),"
+            ' doc: "call std.extVar(\'hostname\')" }',
+            encoding='utf-8',
+        )
+        (root / 'computed.jsonnet').write_text(
+            "local key = 'host' + 'name'; { host: std.extVar(key) }",
+            encoding='utf-8',
+        )
+        tasks: list[apply.JsonnetTask] = []
+        for hostname in ('alpha', 'beta'):
+            host_dir = root / hostname
+            host_dir.mkdir()
+            for name in ('quoted', 'computed'):
+                tasks.append(
+                    apply.JsonnetTask(
+                        hostname,
+                        f'{name}.jsonnet',
+                        root / f'{name}.jsonnet',
+                        {'hostname': hostname},
+                        host_dir / f'{name}.json',
+                    )
+                )
+
+        self.backend.render_manifest(tasks)
+
+        for hostname in ('alpha', 'beta'):
+            quoted = json.loads(
+                (root / hostname / 'quoted.json').read_text(encoding='utf-8')
+            )
+            computed = json.loads(
+                (root / hostname / 'computed.json').read_text(encoding='utf-8')
+            )
+            self.assertEqual(
+                quoted, {'host': hostname, 'doc': "call std.extVar('hostname')"}
+            )
+            self.assertEqual(computed, {'host': hostname})
+
+
+class JsonnetBatchOpTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        backend = apply.get_jsonnet_backend()
+        if isinstance(backend, apply.CliJsonnetBackend) and not shutil.which(
+            apply.find_jsonnet_command()
+        ):
+            raise unittest.SkipTest('no Jsonnet backend is installed')
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+
+    def test_failed_entry_is_reported_and_others_still_render(self) -> None:
+        root = self.test_root
+        (root / 'good.jsonnet').write_text('{ ok: true }', encoding='utf-8')
+        (root / 'bad.jsonnet').write_text('{ ok: }', encoding='utf-8')
+        (root / 'other.jsonnet').write_text("'fine'", encoding='utf-8')
+        tasks = [
+            apply.JsonnetTask('alpha', name, root / name, {}, root / 'out' / output)
+            for name, output in (
+                ('good.jsonnet', 'good.json'),
+                ('bad.jsonnet', 'bad.json'),
+                ('other.jsonnet', 'other.sh'),
+            )
+        ]
+        (root / 'out').mkdir()
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaisesRegex(
+                RuntimeError, '1 of 3 jsonnet evaluations failed'
+            ):
+                apply.JsonnetBatchOp(tasks, jobs=3)()
+
+        self.assertIn('Error details (alpha: bad.jsonnet): ', output.getvalue())
+        self.assertNotIn('good.jsonnet', output.getvalue())
+        self.assertFalse((root / 'out' / 'bad.json').exists())
+        self.assertIn(
+            '"ok": true', (root / 'out' / 'good.json').read_text(encoding='utf-8')
+        )
+        self.assertEqual(
+            (root / 'out' / 'other.sh').read_text(encoding='utf-8'), 'fine\n'
+        )
+
+
+class JsonnetBackendParityTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        try:
+            import _jsonnet  # type: ignore[import-not-found]
+        except ImportError:
+            raise unittest.SkipTest('the _jsonnet binding is not installed')
+        if shutil.which(apply.find_jsonnet_command()) is None:
+            raise unittest.SkipTest('the jsonnet executable is not installed')
+        self.module = _jsonnet
+        self.binding = apply.BindingJsonnetBackend(_jsonnet)
+        self.cli = apply.CliJsonnetBackend()
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+
+    def write(self, name: str, content: str) -> Path:
+        path = self.test_root / name
+        path.write_text(content, encoding='utf-8')
+        return path
+
+    def test_binding_output_matches_cli_byte_for_byte(self) -> None:
+        ext_vars = {'hostname': 'alpha'}
+        cases: list[tuple[Path, str, bool, bool]] = [
+            (
+                self.write(
+                    'plain.jsonnet',
+                    "{ host: std.extVar('hostname'), n: [1, 2.5, -3], "
+                    'nested: { ok: true, none: null, s: \'caf\u00e9 "q"\\t\' } }',
+                ),
+                'plain.json',
+                False,
+                False,
+            ),
+            (
+                self.write(
+                    'string.jsonnet',
+                    "'line one\nline two for ' + std.extVar('hostname')",
+                ),
+                'string.sh',
+                False,
+                False,
+            ),
+            (
+                self.write(
+                    'multi.jsonnet',
+                    "{ 'a.sh': 'echo a', 'b.sh': 'echo ' + std.extVar('hostname') }",
+                ),
+                'multi_strings',
+                True,
+                True,
+            ),
+            (
+                self.write(
+                    'multi_json.jsonnet',
+                    "{ 'c.json': { k: [1, 'two'] }, 'd.json': { flag: false } }",
+                ),
+                'multi_json',
+                True,
+                False,
+            ),
+        ]
+
+        for jsonnet_file, output_name, is_multicast, output_string in cases:
+            with self.subTest(jsonnet_file.name):
+                outputs: dict[str, dict[str, bytes]] = {}
+                for backend in (self.cli, self.binding):
+                    output_path = self.test_root / backend.name / output_name
+                    if is_multicast:
+                        output_path.mkdir(parents=True)
+                    else:
+                        output_path.parent.mkdir(parents=True, exist_ok=True)
+                    backend.render_to_path(
+                        jsonnet_file,
+                        ext_vars,
+                        output_path,
+                        is_multicast=is_multicast,
+                        output_string=output_string,
+                    )
+                    files = (
+                        sorted(output_path.iterdir()) if is_multicast else [output_path]
+                    )
+                    outputs[backend.name] = {f.name: f.read_bytes() for f in files}
+                self.assertEqual(outputs['binding'], outputs['cli'])
+                self.assertTrue(outputs['cli'])
+
+        self.assertEqual(
+            self.binding.evaluate(self.test_root / 'plain.jsonnet', ext_vars),
+            self.cli.evaluate(self.test_root / 'plain.jsonnet', ext_vars),
+        )
+
+    def test_split_outputs_format_numbers_like_the_engine(self) -> None:
+        # -m output is re-manifested in Python; the engine's own manifest of
+        # each field (what the CLI writes) is the reference.
+        jsonnet_file = self.write(
+            'numbers.jsonnet',
+            "{ 'ints.json': [3.0, -0, 1e20, 1e300, 9007199254740993,"
+            ' 123456789012345678901234567890],'
+            " 'fractions.json': { half: -0.5, tenth: 0.1, small: 1.5e-7,"
+            ' third: 1 / 3, wide: 1e15 + 0.3 } }',
+        )
+        output_path = self.test_root / 'numbers'
+        output_path.mkdir()
+
+        self.binding.render_to_path(jsonnet_file, {}, output_path, is_multicast=True)
+
+        for name in ('ints.json', 'fractions.json'):
+            with self.subTest(name):
+                expected = self.module.evaluate_snippet(
+                    'expected.jsonnet',
+                    f'(import {json.dumps(jsonnet_file.as_posix())})[{json.dumps(name)}]',
+                )
+                self.assertEqual(
+                    (output_path / name).read_text(encoding='utf-8'), expected
+                )
+
+
+class ConfigMemoTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.saved = (Path.cwd(), apply.CWD, apply.OUT_DIR_ROOT)
+        os.chdir(self.test_root)
+        apply.CWD = self.test_root
+        apply.OUT_DIR_ROOT = self.test_root / 'out'
+        apply._source_fingerprints.clear()
+        apply._verified_sources.clear()
+        apply._jsonnet_source_deps.clear()
+        (self.test_root / 'apply_configs.jsonnet').write_text(
+            "local hosts = import 'hosts.libsonnet';\n"
+            '{ hosts: hosts, workspace_overrides: {}, vim_pack_plugin_start_repos: [],'
+            ' vim_pack_plugin_opt_repos: [], zsh_plugin_repos: [] }',
+            encoding='utf-8',
+        )
+        self.write_hosts(['alpha'])
+
+    def tearDown(self) -> None:
+        cwd, apply.CWD, apply.OUT_DIR_ROOT = self.saved
+        os.chdir(cwd)
+        apply._source_fingerprints.clear()
+        apply._verified_sources.clear()
+        apply._jsonnet_source_deps.clear()
+        shutil.rmtree(self.test_root)
+
+    def write_hosts(self, names: list[str]) -> None:
+        (self.test_root / 'hosts.libsonnet').write_text(
+            json.dumps(
+                [
+                    {'hostname': n, 'config_dir': '.config/dotShell', 'home': '/h'}
+                    for n in names
+                ]
+            ),
+            encoding='utf-8',
+        )
+
+    def load(self, skip_cache: bool = False) -> tuple[list[str], int]:
+        with mock.patch.object(
+            apply, 'parse_jsonnet_now', wraps=apply.parse_jsonnet_now
+        ) as evaluate:
+            loaded = apply.Config.load(skip_cache=skip_cache)
+        return [h.hostname for h in loaded.hosts], evaluate.call_count
+
+    def test_memo_is_reused_until_an_import_changes(self) -> None:
+        self.assertEqual(self.load(), (['alpha'], 1))
+        self.assertEqual(self.load(), (['alpha'], 0))
+
+        self.write_hosts(['alpha', 'beta'])
+        self.assertEqual(self.load(), (['alpha', 'beta'], 1))
+        self.assertEqual(self.load(), (['alpha', 'beta'], 0))
+
+        config_path = self.test_root / 'apply_configs.jsonnet'
+        config_path.write_text(
+            config_path.read_text(encoding='utf-8').replace(
+                'hosts: hosts', 'hosts: hosts[1:]'
+            ),
+            encoding='utf-8',
+        )
+        self.assertEqual(self.load(), (['beta'], 1))
+
+    def test_cache_validity_is_only_computed_for_staged_hosts(self) -> None:
+        self.write_hosts(['alpha', 'beta'])
+        (self.test_root / 'ghostty').mkdir()
+        (self.test_root / 'ghostty' / 'xterm-ghostty.terminfo').write_text(
+            'xterm-ghostty|ghostty,\n', encoding='utf-8'
+        )
+        with (
+            mock.patch.object(
+                apply.Host,
+                'compute_jsonnet_inputs_hash',
+                autospec=True,
+                return_value='',
+            ) as jsonnet_hash,
+            mock.patch.object(
+                apply.Host, 'compute_curl_inputs_hash', autospec=True, return_value=''
+            ) as curl_hash,
+            contextlib.redirect_stdout(io.StringIO()),
+        ):
+            apply.main(['generate-workspace', '--working-dir', str(self.test_root)])
+            jsonnet_hash.assert_not_called()
+            curl_hash.assert_not_called()
+
+            apply.main(['stage', '--hosts', 'alpha', '--dry-run', '--working-dir', '.'])
+
+        hashed = {
+            call.args[0].hostname
+            for call in jsonnet_hash.call_args_list + curl_hash.call_args_list
+        }
+        self.assertEqual(hashed, {'alpha'})
+
+    def test_skip_cache_bypasses_the_memo(self) -> None:
+        self.assertEqual(self.load(), (['alpha'], 1))
+        self.assertEqual(self.load(skip_cache=True), (['alpha'], 1))
+        self.assertEqual(self.load(), (['alpha'], 0))
+
+
+class CurlRevalidationTests(unittest.TestCase):
+    test_root: Path
+    server: ThreadingHTTPServer
+    full_responses: int
+    connections: int
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.full_responses = 0
+        self.connections = 0
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self) -> None:
+                super().setup()
+                test.connections += 1
+
+            def do_GET(self) -> None:
+                if self.path.startswith('/moved/'):
+                    self.send_response(302)
+                    self.send_header('Location', self.path.removeprefix('/moved'))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                test.full_responses += 1
+                if self.path.startswith('/slow/'):
+                    time.sleep(0.5)
+                body = b'echo hello\n'
+                self.send_response(200)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.test_root)
+
+    def test_second_fetch_revalidates_without_body(self) -> None:
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/script.sh'
+        dest = self.test_root / 'script.sh'
+        store = apply.CurlStore(self.test_root / 'cas')
+
+        apply.CurlFetch(url, dest, store)()
+        store.save()
+        first_fetch = store.record(url)['fetched_at']
+        # A later run reloads the index and revalidates the stored body.
+        store = apply.CurlStore(self.test_root / 'cas')
+        apply.CurlFetch(url, dest, store, revalidate=True)()
+
+        self.assertEqual(self.full_responses, 1)
+        self.assertEqual(dest.read_bytes(), b'echo hello\n')
+        self.assertEqual(store.record(url)['etag'], '"v1"')
+        self.assertGreaterEqual(store.record(url)['fetched_at'], first_fetch)
+
+    def test_batch_reuses_connections_and_follows_redirects(self) -> None:
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        store = apply.CurlStore(self.test_root / 'cas')
+        fetches = [
+            apply.CurlFetch(f'{base}/moved/{i}.sh', self.test_root / f'{i}.sh', store)
+            for i in range(6)
+        ]
+
+        apply.CurlBatchOp(fetches, store, jobs=2)()
+
+        self.assertEqual(self.full_responses, 6)
+        self.assertLessEqual(self.connections, 2)
+        for fetch in fetches:
+            self.assertEqual(fetch.dest.read_bytes(), b'echo hello\n')
+
+    def test_batch_reports_each_failed_url(self) -> None:
+        base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        store = apply.CurlStore(self.test_root / 'cas')
+        good = apply.CurlFetch(f'{base}/ok.sh', self.test_root / 'ok.sh', store)
+        bad = apply.CurlFetch('ftp://example.test/x.sh', self.test_root / 'x.sh', store)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaisesRegex(RuntimeError, '1 of 2 curl downloads failed'):
+                apply.CurlBatchOp([good, bad], store, jobs=2)()
+
+        self.assertEqual(good.dest.read_bytes(), b'echo hello\n')
+        self.assertIn(
+            f'Failed downloading ftp://example.test/x.sh -> {bad.dest}: ',
+            output.getvalue(),
+        )
+
+    def test_store_shares_bodies_and_checks_pinned_digests(self) -> None:
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/script.sh'
+        store = apply.CurlStore(self.test_root / 'cas')
+        digest = hashlib.sha256(b'echo hello\n').hexdigest()
+        first = self.test_root / 'alpha' / 'script.sh'
+        second = self.test_root / 'beta' / 'script.sh'
+        first.parent.mkdir()
+        second.parent.mkdir()
+
+        apply.CurlFetch(url, first, store, revalidate=True)()
+        apply.CurlFetch(url, second, store, revalidate=True)()
+
+        self.assertEqual(self.full_responses, 1)
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertTrue(os.path.samefile(first, store.blob_path(digest)))
+
+        # A pinned blob is reused without any request; a wrong pin fails.
+        offline = apply.CurlStore(self.test_root / 'cas')
+        apply.CurlFetch('http://invalid.test/x', first, offline, digest)()
+        with self.assertRaises(ValueError):
+            apply.CurlFetch(url, second, offline, '0' * 64, revalidate=True)()
+        self.assertEqual(self.full_responses, 2)
+
+    def test_concurrent_fetches_of_one_url_download_once(self) -> None:
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/slow/script.sh'
+        shared = apply.CurlStore(self.test_root / 'cas')
+        # Two threads on one store, plus a second store standing in for
+        # another host pipeline process.
+        fetches = [
+            apply.CurlFetch(url, self.test_root / 'a.sh', shared, revalidate=True),
+            apply.CurlFetch(url, self.test_root / 'b.sh', shared, revalidate=True),
+            apply.CurlFetch(
+                url,
+                self.test_root / 'c.sh',
+                apply.CurlStore(self.test_root / 'cas'),
+                revalidate=True,
+            ),
+        ]
+
+        threads = [threading.Thread(target=fetch) for fetch in fetches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.full_responses, 1)
+        for fetch in fetches:
+            self.assertEqual(fetch.dest.read_bytes(), b'echo hello\n')
+
+    def test_parallel_host_curl_nodes_share_downloads(self) -> None:
+        # stage_hosts_graph runs every host's curl node at once on one store.
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/slow/script.sh'
+        store = apply.CurlStore(self.test_root / 'cas')
+        nodes = []
+        for host in ('alpha', 'beta'):
+            dest = self.test_root / host / 'script.sh'
+            dest.parent.mkdir()
+            fetch = apply.CurlFetch(url, dest, store, revalidate=True)
+            nodes.append(
+                apply.OpNode(
+                    f'{host}: curl',
+                    [apply.CurlBatchOp([fetch], store)],
+                    outputs=[dest.parent],
+                )
+            )
+
+        apply.OpGraph(nodes, jobs=2, quiet=True)()
+
+        self.assertEqual(self.full_responses, 1)
+        self.assertTrue(
+            os.path.samefile(
+                self.test_root / 'alpha' / 'script.sh',
+                self.test_root / 'beta' / 'script.sh',
+            )
+        )
+
+    def test_concurrent_stores_keep_each_others_index_entries(self) -> None:
+        # Parallel host pipelines each hold their own CurlStore on out/cas.
+        first = apply.CurlStore(self.test_root / 'cas')
+        second = apply.CurlStore(self.test_root / 'cas')
+        first.add('http://example.test/a', b'a')
+        second.add('http://example.test/b', b'b')
+
+        first.save()
+        second.save()
+
+        reloaded = apply.CurlStore(self.test_root / 'cas')
+        self.assertIn('http://example.test/a', reloaded.index)
+        self.assertIn('http://example.test/b', reloaded.index)
+
+
+class BulkCopyTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+
+    def test_copies_trees_and_files_preserving_mode_and_mtime(self) -> None:
+        src = self.test_root / 'src'
+        (src / 'tree' / 'nested').mkdir(parents=True)
+        (src / 'tree' / 'nested' / 'image.bin').write_bytes(bytes(range(256)) * 64)
+        script = src / 'run.sh'
+        script.write_text('echo hi\n', encoding='utf-8')
+        script.chmod(0o750)
+        os.utime(script, ns=(1_000_000_000, 1_000_000_000))
+        dest = self.test_root / 'dest'
+
+        op = apply.BulkCopy(
+            files=[(script, dest / 'bin' / 'run.sh')],
+            directories=[(src / 'tree', dest / 'tree')],
+        )
+        op()
+
+        self.assertEqual(
+            (dest / 'tree' / 'nested' / 'image.bin').read_bytes(),
+            bytes(range(256)) * 64,
+        )
+        copied = (dest / 'bin' / 'run.sh').stat()
+        self.assertEqual(copied.st_mode & 0o777, 0o750)
+        self.assertEqual(copied.st_mtime_ns, 1_000_000_000)
+        self.assertIn(
+            ['cp', '-a', f'{(src / "tree").as_posix()}/.', (dest / 'tree').as_posix()],
+            op.describe(),
+        )
+
+    def test_linked_artifacts_are_replaced_not_rewritten(self) -> None:
+        cached = self.test_root / 'gen' / 'settings.json'
+        cached.parent.mkdir()
+        cached.write_text('#pragma once\n', encoding='utf-8')
+        staged = self.test_root / 'staged' / 'settings.json'
+
+        apply.BulkCopy(linked_files=[(cached, staged)])()
+        self.assertTrue(os.path.samefile(cached, staged))
+
+        apply.write_text_atomic(staged, 'expanded\n')
+        self.assertEqual(cached.read_text(encoding='utf-8'), '#pragma once\n')
+        self.assertEqual(staged.read_text(encoding='utf-8'), 'expanded\n')
+
+
+class IncrementalStageTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.saved_out_dir_root = apply.OUT_DIR_ROOT
+        apply.OUT_DIR_ROOT = self.test_root / 'out'
+
+    def tearDown(self) -> None:
+        apply.OUT_DIR_ROOT = self.saved_out_dir_root
+        shutil.rmtree(self.test_root)
+
+    def test_restages_only_changed_files_and_prunes_removed_ones(self) -> None:
+        host = apply.Host(
+            'stagehost',
+            '.config/dotShell',
+            '/home/someone',
+            file_maps={'rc.sh': '.rc.sh', 'plain.txt': '.config/'},
+            macros={'#pragma once': ['# once @@FILE_NAME']},
+        )
+        src = self.test_root / 'src'
+        src.mkdir()
+        (src / 'rc.sh').write_text('#pragma once\necho rc\n', encoding='utf-8')
+        (src / 'plain.txt').write_text('plain\n', encoding='utf-8')
+        staged = host.local_staging_dir
+
+        def stage(names: list[str]) -> None:
+            copy = apply.BulkCopy(files=[(src / n, staged / n) for n in names])
+            apply.IncrementalStage(host, copy, {staged / 'rc.sh'})()
+
+        stage(['rc.sh', 'plain.txt'])
+        self.assertEqual(
+            (staged / 'rc.sh').read_text(encoding='utf-8'), '# once RC\necho rc\n'
+        )
+        inodes = {n: (staged / n).stat().st_ino for n in ('rc.sh', 'plain.txt')}
+        manifest = json.loads((staged / 'manifest.json').read_text(encoding='utf-8'))
+        self.assertEqual(
+            [(f['path'], f['target'], f['origin']) for f in manifest['files']],
+            [
+                ('plain.txt', '.config/plain.txt', 'file'),
+                ('rc.sh', '.rc.sh', 'macro-expanded'),
+            ],
+        )
+        self.assertEqual(
+            manifest['files'][1]['sha256'],
+            hashlib.sha256(b'# once RC\necho rc\n').hexdigest(),
+        )
+
+        (src / 'plain.txt').write_text('changed\n', encoding='utf-8')
+        stage(['rc.sh', 'plain.txt'])
+        self.assertEqual((staged / 'rc.sh').stat().st_ino, inodes['rc.sh'])
+        self.assertEqual(
+            (staged / 'plain.txt').read_text(encoding='utf-8'), 'changed\n'
+        )
+
+        stage(['rc.sh'])
+        self.assertFalse((staged / 'plain.txt').exists())
+        self.assertEqual((staged / 'rc.sh').stat().st_ino, inodes['rc.sh'])
+
+    def test_stage_and_describe_walk_the_sources_once(self) -> None:
+        host = apply.Host(
+            'stagehost',
+            '.config/dotShell',
+            '/home/someone',
+            directory_maps={'src': '.src'},
+        )
+        src = self.test_root / 'src'
+        (src / 'nested').mkdir(parents=True)
+        (src / 'nested' / 'a.sh').write_text('echo a\n', encoding='utf-8')
+        staged = host.local_staging_dir
+        stage = apply.IncrementalStage(
+            host, apply.BulkCopy(directories=[(src, staged / 'src')])
+        )
+
+        for run in (stage.describe, stage):
+            with mock.patch.object(
+                apply.BulkCopy,
+                'expand',
+                autospec=True,
+                side_effect=apply.BulkCopy.expand,
+            ) as expand:
+                run()
+            self.assertEqual(expand.call_count, 1)
+        self.assertEqual(
+            (staged / 'src' / 'nested' / 'a.sh').read_text(encoding='utf-8'),
+            'echo a\n',
+        )
+
+    def test_macro_files_are_expanded_from_source_in_one_write(self) -> None:
+        host = apply.Host(
+            'stagehost',
+            '.config/dotShell',
+            '/home/someone',
+            file_maps={'rc.sh': '.rc.sh', 'plain.sh': '.plain.sh'},
+            macros={'#pragma once': ['# once @@FILE_NAME']},
+        )
+        src = self.test_root / 'src'
+        src.mkdir()
+        (src / 'rc.sh').write_text('#pragma once\necho rc\n', encoding='utf-8')
+        (src / 'rc.sh').chmod(0o750)
+        (src / 'plain.sh').write_text('echo plain\n', encoding='utf-8')
+        staged = host.local_staging_dir
+        copy = apply.BulkCopy(
+            files=[(src / n, staged / n) for n in ('rc.sh', 'plain.sh')]
+        )
+
+        with mock.patch.object(
+            apply, 'copy_file_preserving', wraps=apply.copy_file_preserving
+        ) as copied:
+            apply.IncrementalStage(
+                host, copy, {staged / 'rc.sh', staged / 'plain.sh'}
+            )()
+
+        self.assertEqual(
+            [call.args[1] for call in copied.call_args_list], [staged / 'plain.sh']
+        )
+        self.assertEqual(
+            (staged / 'rc.sh').read_text(encoding='utf-8'), '# once RC\necho rc\n'
+        )
+        self.assertEqual((staged / 'rc.sh').stat().st_mode & 0o777, 0o750)
+
+    def test_mode_only_changes_are_restaged(self) -> None:
+        host = apply.Host(
+            'stagehost',
+            '.config/dotShell',
+            '/home/someone',
+            file_maps={'debug.sh': '.debug.sh'},
+            directory_maps={'tree': '.tree'},
+        )
+        src = self.test_root / 'src'
+        (src / 'tree').mkdir(parents=True)
+        script = src / 'debug.sh'
+        script.write_text('echo debug\n', encoding='utf-8')
+        script.chmod(0o644)
+        (src / 'tree' / 'a.txt').write_text('a\n', encoding='utf-8')
+        os.utime(src / 'tree', ns=(1_000_000_000, 1_000_000_000))
+        staged = host.local_staging_dir
+        copy = apply.BulkCopy(
+            files=[(script, staged / 'debug.sh')],
+            directories=[(src / 'tree', staged / 'tree')],
+        )
+
+        apply.IncrementalStage(host, copy)()
+        script.chmod(0o755)
+        apply.IncrementalStage(host, copy)()
+
+        self.assertEqual((staged / 'debug.sh').stat().st_mode & 0o777, 0o755)
+        install_list = (staged / 'manifest.tsv').read_text(encoding='utf-8')
+        self.assertIn('\t0755\tdebug.sh\t', install_list)
+        # Staged directories keep their source mtimes, as with BulkCopy.
+        self.assertEqual((staged / 'tree').stat().st_mtime_ns, 1_000_000_000)
+
+
+class DeltaInstallTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_root)
+
+    def test_finish_script_installs_only_differences(self) -> None:
+        host = apply.Host('deltahost', '.config/dotShell', '/home/someone')
+        stage = self.test_root / 'stage'
+        home = self.test_root / 'home'
+        stage.mkdir()
+        home.mkdir()
+        full_install_ops: list[apply.RunOp] = [
+            apply.BASH_COMMAND_PREFIX + 'echo FULL',
+            apply.BASH_COMMAND_PREFIX + 'cp "$SCRIPT_DIR/a.sh" "$HOME/.a.sh"',
+        ]
+        script = stage / 'finish.sh'
+        for op in apply.make_finish_script(
+            apply.make_install_bash_commands(host, full_install_ops), script, False
+        ):
+            if callable(op):
+                op()
+
+        def write_manifest(entries: dict[str, str]) -> None:
+            (stage / 'manifest.tsv').write_text(
+                ''.join(
+                    f'{apply.hash_file_sha256(stage / path)}\t0644\t{path}\t{target}\n'
+                    for path, target in entries.items()
+                ),
+                encoding='utf-8',
+            )
+
+        def finish(*args: str) -> str:
+            return subprocess.run(
+                ['bash', script.as_posix(), *args],
+                env={**os.environ, 'HOME': home.as_posix()},
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+
+        (stage / 'a.sh').write_text('a\n', encoding='utf-8')
+        (stage / 'b.sh').write_text('b\n', encoding='utf-8')
+        write_manifest({'a.sh': '.a.sh'})
+        self.assertIn('FULL', finish())
+
+        write_manifest({'a.sh': '.a.sh', 'b.sh': '.config/b.sh'})
+        output = finish()
+        self.assertNotIn('FULL', output)
+        self.assertIn(f'Installing {home}/.config/b.sh', output)
+        self.assertNotIn('.a.sh', output)
+
+        write_manifest({'b.sh': '.config/b.sh'})
+        self.assertIn(f'Removing {home}/.a.sh', finish())
+        self.assertFalse((home / '.a.sh').exists())
+        self.assertIn('FULL', finish('--full'))
+
+
+class SshMultiplexingTests(unittest.TestCase):
+    def test_remote_commands_share_one_control_path(self) -> None:
+        if not apply.ssh_multiplexing_supported():
+            raise unittest.SkipTest('ssh multiplexing is not used on this platform')
+        host = apply.Host('remotehost', '.config/dotShell', '/home/someone')
+        control_path = f'ControlPath={(apply.ssh_control_dir() / "%C").as_posix()}'
+
+        (ssh_op,) = host.make_ops([['mkdir', '-p', '/tmp/x']])
+        rsync_op = host.rsync_command('-a', 'src/', 'remotehost:dest')
+
+        self.assertIn(control_path, ssh_op)
+        self.assertEqual(ssh_op[-2:], ['remotehost', 'mkdir -p /tmp/x'])
+        self.assertEqual(rsync_op[1], '-e')
+        self.assertIn(control_path, rsync_op[2])
+        self.assertIn(control_path, host.scp_command('a', 'remotehost:b'))
+
+
+class RemoteBatchTests(unittest.TestCase):
+    test_root: Path
+
+    def setUp(self) -> None:
+        self.test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        # Stand-in ssh: drop options and the host, run the command locally.
+        fake_ssh = self.test_root / 'ssh'
+        fake_ssh.write_text(
+            '#!/bin/sh\n'
+            'while [ "$1" = "-o" ]; do shift 2; done\n'
+            'shift\n'
+            'exec sh -c "$*"\n',
+            encoding='utf-8',
+        )
+        fake_ssh.chmod(0o755)
+        self.environ = mock.patch.dict(
+            os.environ, {'PATH': f'{self.test_root}{os.pathsep}{os.environ["PATH"]}'}
+        )
+        self.environ.start()
+
+    def tearDown(self) -> None:
+        self.environ.stop()
+        shutil.rmtree(self.test_root)
+
+    def test_batch_runs_in_order_and_reports_the_failing_command(self) -> None:
+        host = apply.Host('remotehost', '.config/dotShell', '/home/someone')
+        marker = self.test_root / 'ran'
+        latin1 = self.test_root / 'latin1.txt'
+        latin1.write_bytes(b'\xfflatin\n')
+        (batch,) = host.make_ops(
+            [
+                ['echo', 'first output'],
+                ['cat', latin1.as_posix()],
+                ['touch', marker.as_posix()],
+                ['sh', '-c', 'exit 3'],
+                ['echo', 'never'],
+            ]
+        )
+        self.assertIsInstance(batch, apply.RemoteBatch)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(subprocess.CalledProcessError) as raised:
+                batch()
+
+        self.assertEqual(raised.exception.returncode, 3)
+        self.assertEqual(raised.exception.cmd[-1], 'sh -c "exit 3"')
+        self.assertTrue(marker.exists())
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], 'first output')
+        self.assertEqual(lines[1], '\ufffdlatin')
+        self.assertNotIn('never', output.getvalue())
+        self.assertNotIn(apply.REMOTE_STATUS_MARKER, output.getvalue())
+        self.assertTrue(lines[-1].startswith('Failed running: ssh '))
+
+
+class HostPipelinesTests(unittest.TestCase):
+    @staticmethod
+    def python_command(source: str) -> list[str]:
+        return [sys.executable, '-c', source]
+
+    def run_pipelines(self, pipelines: apply.HostPipelines) -> tuple[str, Exception]:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(RuntimeError) as raised:
+                pipelines()
+        return output.getvalue(), raised.exception
+
+    def test_failure_and_timeout_are_isolated_and_summarized(self) -> None:
+        pipelines = apply.HostPipelines(
+            {
+                'good': self.python_command('print("staged good")'),
+                'broken': self.python_command('print("about to fail"); exit(4)'),
+                'stuck': self.python_command('import time; time.sleep(30)'),
+            },
+            jobs=3,
+            timeout=2,
+        )
+
+        start = time.monotonic()
+        output, error = self.run_pipelines(pipelines)
+
+        self.assertLess(time.monotonic() - start, 20)
+        lines = output.splitlines()
+        self.assertIn('[good  ] staged good', lines)
+        self.assertIn('[broken] about to fail', lines)
+        self.assertIn('broken, stuck', str(error))
+
+        header = next(i for i, line in enumerate(lines) if line.startswith('Host '))
+        summary = lines[header:]
+        self.assertEqual(summary[0].split(), ['Host', 'Status', 'Duration'])
+        rows = {row.split()[0]: row for row in summary[1:]}
+        self.assertEqual(list(rows), ['good', 'broken', 'stuck'])
+        self.assertIn(' ok ', rows['good'])
+        self.assertIn('failed (exit 4)', rows['broken'])
+        self.assertIn('timed out after 2s', rows['stuck'])
+
+    def test_hosts_run_concurrently(self) -> None:
+        sleeper = self.python_command('import time; time.sleep(1)')
+        pipelines = apply.HostPipelines(
+            {'alpha': sleeper, 'beta': sleeper, 'gamma': sleeper}, jobs=3
+        )
+
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipelines()
+
+        self.assertLess(time.monotonic() - start, 2.5)
+
+
+class OpGraphTests(unittest.TestCase):
+    def test_dependencies_follow_overlapping_paths_and_declared_deps(self) -> None:
+        out = Path('/out/host')
+        graph = apply.OpGraph(
+            [
+                apply.OpNode('curl', [], outputs=[out / 'curl']),
+                apply.OpNode('jsonnet', [], outputs=[out / 'gen']),
+                apply.OpNode(
+                    'stage',
+                    [],
+                    inputs=[out / 'curl', out / 'gen'],
+                    outputs=[out / 'staged'],
+                ),
+                apply.OpNode('finish', [], outputs=[out / 'staged' / 'finish.sh']),
+                apply.OpNode('unrelated', [], outputs=[out / 'staged2']),
+                apply.OpNode('push', [], inputs=[out / 'staged'], deps=['unrelated']),
+            ]
+        )
+
+        self.assertEqual(
+            graph.dependencies(),
+            {
+                'curl': [],
+                'jsonnet': [],
+                'stage': ['curl', 'jsonnet'],
+                'finish': ['stage'],
+                'unrelated': [],
+                'push': ['unrelated', 'stage', 'finish'],
+            },
+        )
+        described = [op for op in graph.describe() if isinstance(op, str)]
+        self.assertEqual(described[-1], '== push (after unrelated, stage, finish)')
+
+    def test_independent_nodes_run_concurrently(self) -> None:
+        barrier = threading.Barrier(2, timeout=5)
+        order: list[str] = []
+        graph = apply.OpGraph(
+            [
+                apply.OpNode('a', [barrier.wait], outputs=[Path('/a')]),
+                apply.OpNode('b', [barrier.wait], outputs=[Path('/b')]),
+                apply.OpNode(
+                    'after', [lambda: order.append('after')], inputs=[Path('/a/x')]
+                ),
+            ],
+            jobs=2,
+        )
+
+        graph()
+
+        self.assertEqual(order, ['after'])
+
+    def test_failure_skips_dependents_and_is_raised(self) -> None:
+        ran: list[str] = []
+
+        def fail() -> None:
+            raise ValueError('boom')
+
+        graph = apply.OpGraph(
+            [
+                apply.OpNode('broken', [fail], outputs=[Path('/x')]),
+                apply.OpNode(
+                    'dependent', [lambda: ran.append('dependent')], deps=['broken']
+                ),
+            ]
+        )
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaisesRegex(ValueError, 'boom'):
+                graph()
+
+        self.assertEqual(ran, [])
+        self.assertIn('Skipped after failure: dependent', output.getvalue())
+
+    def test_cycles_are_rejected(self) -> None:
+        graph = apply.OpGraph(
+            [apply.OpNode('a', [], deps=['b']), apply.OpNode('b', [], deps=['a'])]
+        )
+        with self.assertRaisesRegex(ValueError, 'cycle'):
+            graph.topological_order()
+
+
+class OpTimingsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.timings = apply.OpTimings()
+        apply.OP_TIMINGS = self.timings
+
+    def tearDown(self) -> None:
+        apply.OP_TIMINGS = None
+
+    def test_records_status_host_phase_and_nested_spans(self) -> None:
+        def stage_with_macros() -> None:
+            with apply.timed_span('', 'macros', 'macro expansion'):
+                time.sleep(0.05)
+
+        ok_command = [sys.executable, '-c', 'pass']
+        failing_command = [sys.executable, '-c', 'raise SystemExit(3)']
+        graph = apply.OpGraph(
+            [apply.OpNode('alpha: stage', [ok_command, stage_with_macros])]
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            apply.run_ops([graph])
+            with self.assertRaises(subprocess.CalledProcessError):
+                apply.run_ops([failing_command])
+
+        records = {record.name: record for record in self.timings.records}
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records['macro expansion'].host, 'alpha')
+        self.assertEqual(records['macro expansion'].phase, 'macros')
+        outer = next(r for r in records.values() if r.phase == 'callable')
+        self.assertEqual(outer.host, 'alpha')
+        self.assertGreaterEqual(outer.seconds, 0.05)
+        self.assertLess(outer.exclusive_seconds, 0.05)
+        statuses = sorted(r.status for r in records.values() if r.phase == 'command')
+        self.assertEqual(statuses, ['exit 3', 'ok'])
+
+        summary = self.timings.summary(top=2)
+        self.assertEqual(summary[0], '>> Slowest 2 of 4 ops')
+        self.assertIn('>> Time by host and phase (excluding nested spans)', summary)
+
+        trace = json.loads(json.dumps(self.timings.chrome_trace()))
+        spans = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(spans), 4)
+        self.assertEqual({e['cat'] for e in spans}, {'command', 'callable', 'macros'})
+        self.assertTrue(all(e['dur'] >= 0 and e['ts'] >= 0 for e in spans))
+
+    def test_ssh_and_rsync_ops_are_attributed_to_their_host(self) -> None:
+        host = apply.Host('remotehost', '.config/dotShell', '/home/someone')
+        finish = host.make_ops([['/bin/bash', '/home/someone/finish.sh']])[0]
+        rsync = host.rsync_command('-a', 'staged/', 'remotehost:staging')
+
+        self.assertEqual(
+            apply.op_timing_labels(finish)[:2], ('remotehost', 'remote finish')
+        )
+        self.assertEqual(apply.op_timing_labels(rsync)[:2], ('remotehost', 'rsync'))
+
+    def test_host_pipeline_traces_merge_into_the_parent_trace(self) -> None:
+        test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.addCleanup(shutil.rmtree, test_root)
+        trace_path = test_root / 'trace.json'
+        with self.timings.span('', 'pipelines', '2 host pipelines'):
+            time.sleep(0.01)
+            child = apply.OpTimings()
+            with child.span('alpha', 'copy', 'incremental stage'):
+                pass
+        alpha_path = apply.host_trace_path(trace_path, 'alpha')
+        alpha_path.write_text(
+            json.dumps(child.chrome_trace('apply.py stage (alpha)')), encoding='utf-8'
+        )
+
+        trace = self.timings.chrome_trace('apply.py stage (alpha, beta)')
+        merged = [alpha_path, apply.host_trace_path(trace_path, 'beta')]
+        apply.merge_chrome_traces(trace, merged)
+
+        self.assertEqual(alpha_path.name, 'trace.json.alpha.json')
+        self.assertFalse(alpha_path.exists())
+        names = [
+            e['args']['name']
+            for e in trace['traceEvents']
+            if e['name'] == 'process_name'
+        ]
+        self.assertEqual(
+            names, ['apply.py stage (alpha, beta)', 'apply.py stage (alpha)']
+        )
+        parent, nested = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        # Both processes use wall-clock timestamps, so the child's span lands
+        # inside the parent's.
+        self.assertGreaterEqual(nested['ts'], parent['ts'])
+        self.assertLessEqual(
+            nested['ts'] + nested['dur'], parent['ts'] + parent['dur'] + 1
+        )
+
+    def test_rsync_and_finish_ops_report_bytes_moved(self) -> None:
+        test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.addCleanup(shutil.rmtree, test_root)
+        fake_rsync = test_root / 'bin' / 'rsync'
+        fake_rsync.parent.mkdir()
+        fake_rsync.write_text(
+            '#!/bin/sh\n[ "$1" = --stats ] || exit 9\n'
+            'echo "sending incremental file list"\n'
+            'echo "Total bytes sent: 1,234"\n',
+            encoding='utf-8',
+        )
+        fake_rsync.chmod(0o755)
+        path = f'{fake_rsync.parent}{os.pathsep}{os.environ["PATH"]}'
+
+        output = io.StringIO()
+        with (
+            mock.patch.dict(os.environ, {'PATH': path}),
+            contextlib.redirect_stdout(output),
+        ):
+            apply.run_ops([['rsync', '-a', 'staged/', 'remotehost:staging']])
+
+        self.assertIn('sending incremental file list', output.getvalue())
+        [record] = self.timings.records
+        self.assertEqual((record.phase, record.bytes_moved), ('rsync', 1234))
+
+        saved_out_dir_root = apply.OUT_DIR_ROOT
+        apply.OUT_DIR_ROOT = test_root / 'out'
+        self.addCleanup(setattr, apply, 'OUT_DIR_ROOT', saved_out_dir_root)
+        host = apply.Host('remotehost', '.config/dotShell', '/home/someone')
+        host.local_staging_dir.mkdir(parents=True)
+        (host.local_staging_dir / 'rc.sh').write_bytes(b'x' * 10)
+        (host.local_staging_dir / 'nested').mkdir()
+        (host.local_staging_dir / 'nested' / 'a.sh').write_bytes(b'y' * 5)
+        finish = apply.RemoteFinish(host)
+
+        self.assertEqual(
+            finish.describe(),
+            host.make_ops([['/bin/bash', f'{host.remote_staging_dir}/finish.sh']]),
+        )
+        self.assertEqual(
+            apply.op_timing_labels(finish)[:2], ('remotehost', 'remote finish')
+        )
+        self.assertEqual(finish.bytes_moved, 15)
+
+
+class MacroEngineTests(unittest.TestCase):
+    macros = {
+        '#pragma once': ['[ -n "${PRAGMA_@@FILE_NAME}" ] && return'],
+        '#pragma requires': ['source "${ROOT}/@@PRAGMA_ARG" # @@FILE_NAME'],
+        '#pragma watermark': ['# Generated - @@NOW'],
+    }
+
+    def test_expands_matching_lines_in_one_pass(self) -> None:
+        engine = apply.MacroEngine(self.macros)
+        content = (
+            '#!/bin/bash\n#pragma once\n#pragma requires lib.sh  \n'
+            'echo "#pragma once"\n#pragma watermark\n'
+        )
+
+        self.assertEqual(
+            engine.expand(content, 'RC'),
+            '#!/bin/bash\n'
+            '[ -n "${PRAGMA_RC}" ] && return\n'
+            'source "${ROOT}/lib.sh" # RC\n'
+            'echo "#pragma once"\n'
+            f'# Generated - {apply.macro_now()}\n',
+        )
+        self.assertIsNone(engine.expand('echo plain\n', 'RC'))
+
+    def test_keys_are_tried_in_definition_order(self) -> None:
+        engine = apply.MacroEngine({'#pragma': ['short'], '#pragma long': ['long']})
+        self.assertEqual(engine.expand('#pragma long\n', 'X'), 'short\n')
+
+    def test_files_without_a_pragma_are_left_to_the_plain_copy(self) -> None:
+        test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.addCleanup(shutil.rmtree, test_root)
+        host = apply.Host(
+            'macrohost', '.config/dotShell', '/home/someone', macros=self.macros
+        )
+        stage = apply.IncrementalStage(host, apply.BulkCopy())
+        binary = test_root / 'image.bin'
+        binary.write_bytes(b'\xff\xfe not utf-8')
+        plain = test_root / 'plain.sh'
+        plain.write_text('echo plain\n', encoding='utf-8')
+
+        self.assertFalse(host.macro_engine.may_match(binary.read_bytes()))
+        self.assertFalse(stage.stage_with_macros(binary, test_root / 'out.bin'))
+        self.assertFalse(stage.stage_with_macros(plain, test_root / 'out.sh'))
+        self.assertFalse((test_root / 'out.bin').exists())
+        self.assertFalse((test_root / 'out.sh').exists())
+
+
+class GitTrackedIndexTests(unittest.TestCase):
+    def test_directory_queries_respect_path_components(self) -> None:
+        index = apply.GitTrackedIndex(
+            ['shell2/x.sh', 'shell/a.sh', 'shell/sub/b.sh', 'shell.md', 'zsh/z.zsh']
+        )
+
+        self.assertEqual(index.under('shell'), ['shell/a.sh', 'shell/sub/b.sh'])
+        self.assertEqual(index.under(Path('shell/sub')), ['shell/sub/b.sh'])
+        self.assertEqual(len(index.under('.')), 5)
+        self.assertIn(Path('shell.md'), index)
+        self.assertNotIn('shell', index)
+
+    def test_index_is_cached_until_the_git_index_changes(self) -> None:
+        test_root = Path(tempfile.mkdtemp(prefix='dotfiles-apply.'))
+        self.addCleanup(shutil.rmtree, test_root)
+        saved_out_dir_root = apply.OUT_DIR_ROOT
+        apply.OUT_DIR_ROOT = test_root / 'out'
+        self.addCleanup(setattr, apply, 'OUT_DIR_ROOT', saved_out_dir_root)
+        self.addCleanup(apply._git_tracked_indexes.clear)
+
+        def git(*args: str) -> None:
+            subprocess.run(
+                ['git', *args], cwd=test_root, check=True, capture_output=True
+            )
+
+        git('init', '-q')
+        (test_root / 'a.sh').write_text('a\n', encoding='utf-8')
+        git('add', 'a.sh')
+        # Age the Git index past the racy window so it may be persisted.
+        os.utime(test_root / '.git' / 'index', ns=(1_000_000_000, 1_000_000_000))
+
+        self.assertEqual(apply.git_tracked_index(test_root).paths, ['a.sh'])
+        self.assertTrue((test_root / 'out' / 'git_tracked.json').is_file())
+
+        apply._git_tracked_indexes.clear()
+        with mock.patch.object(apply, 'git_ls_files') as ls_files:
+            self.assertEqual(apply.git_tracked_index(test_root).paths, ['a.sh'])
+        ls_files.assert_not_called()
+
+        (test_root / 'b.sh').write_text('b\n', encoding='utf-8')
+        git('add', 'b.sh')
+        self.assertEqual(apply.git_tracked_index(test_root).paths, ['a.sh', 'b.sh'])
+
+
+class PathSetTests(unittest.TestCase):
+    def test_pruning_compares_components_not_prefixes(self) -> None:
+        paths = apply.PathSet(['/foo/bar', '/foo/bar2', '/foo/bar/baz', '/foo/bar/'])
+
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(paths.roots(), ['/foo/bar', '/foo/bar2'])
+        self.assertEqual(paths.leaves(), ['/foo/bar/baz', '/foo/bar2'])
+        self.assertTrue(paths.covers('/foo/bar/baz/qux'))
+        self.assertFalse(paths.covers('/foo/bar3'))
+        self.assertTrue(paths.overlaps('/foo'))
+        self.assertFalse(paths.overlaps('/foo/ba'))
+
+    def test_parent_pruning_does_not_resolve_paths(self) -> None:
+        with mock.patch.object(
+            apply.Path, 'resolve', side_effect=AssertionError('resolve() called')
+        ):
+            ops = apply.ensure_directories_exist_ops(
+                ['out/a', 'out/a/b', 'out/a/b/c', 'out/a2', 'out']
+            )
+
+        self.assertEqual(ops, [['mkdir', '-p', 'out/a/b/c'], ['mkdir', '-p', 'out/a2']])
+
+    def test_clean_keeps_siblings_that_share_a_prefix(self) -> None:
+        host = apply.Host(
+            'cleanhost',
+            '.config/dotShell',
+            '/home/someone',
+            file_maps={
+                'vim/vimrc': '.vimrc',
+                'vim/vimrc2': '.vimrc2',
+                'shell/inner.sh': '.config/dotShell/inner.sh',
+                'konsole/konsolerc': '.config/konsolerc',
+            },
+            directory_maps={'vim/colors': '.vim', 'vim/colors2': '.vim2/'},
+        )
+
+        ops = apply.clean_remote_dotfiles(host, treat_as_localhost=True)
+
+        home = apply.HOME_VAR_PATH
+        self.assertEqual(
+            ops,
+            [
+                '>> Cleaning existing configuration files for cleanhost',
+                ['rm', '-rf', f'{home}/.config/dotShell'],
+                ['rm', '-rf', f'{home}/.vim'],
+                ['rm', '-rf', f'{home}/.vim2/'],
+                ['rm', '-f', f'{home}/.config/konsolerc'],
+                ['rm', '-f', f'{home}/.vimrc'],
+                ['rm', '-f', f'{home}/.vimrc2'],
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()